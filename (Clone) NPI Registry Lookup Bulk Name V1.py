@@ -12,12 +12,18 @@
 
 # COMMAND ----------
 
-import requests
 import json
 import pandas as pd
 import numpy as np
 from pprint import pprint
 from flatten_json import flatten
+from npi_registry import RegistryClient
+
+# COMMAND ----------
+
+#shared registry client: one keep-alive session per thread, retries 429/5xx with backoff,
+#and failed queries come back with result_count 0 and an "error" message instead of raising
+client = RegistryClient()
 
 # COMMAND ----------
 
@@ -87,10 +93,9 @@ for i in range(df.shape[0]):
   
 
   #build request
-  request = f'l.cms.hhs.gov/api/?number=&enumeration_type=NPI-1&taxonomy_description=&first_name={First_Name}&last_name={Last_Name}&organization_name=&address_purpose=&city=&state={State}&postal_code=&country_code=&limit={Limit}&skip=&version={Version}&use_first_name_alias=False'
+  params = {'enumeration_type': 'NPI-1', 'first_name': First_Name, 'last_name': Last_Name, 'state': State, 'limit': Limit, 'version': Version}
 
-  r = requests.get(request)
-  results_json = r.json()
+  results_json = client.search({**params, 'use_first_name_alias': 'False'})
   
   #keep track of match level where 1 = first and last name and state (if present)
   if results_json['result_count'] > 0:
@@ -98,30 +103,25 @@ for i in range(df.shape[0]):
   
   #if no results search first (fuzzy), last name and state
   if results_json['result_count'] == 0:
-    request = f'https://npiregistry.cms.hhs.gov/api/?number=&enumeration_type=NPI-1&taxonomy_description=&first_name={First_Name}&last_name={Last_Name}&organization_name=&address_purpose=&city=&state={State}&postal_code=&country_code=&limit={Limit}&skip=&version={Version}'
-    r = requests.get(request)
-    results_json = r.json()
+    results_json = client.search(params)
     if results_json['result_count'] > 0:
       Match_Level = 2 #first (fuzzy), last name, and state match
 
   #if no results search first and last name only
   if results_json['result_count'] == 0:
-    request = f'https://npiregistry.cms.hhs.gov/api/?number=&enumeration_type=NPI-1&taxonomy_description=&first_name={First_Name}&last_name={Last_Name}&organization_name=&address_purpose=&city=&state={""}&postal_code=&country_code=&limit={Limit}&skip=&version={Version}'
-    r = requests.get(request)
-    results_json = r.json()
+    results_json = client.search({**params, 'state': ''})
     if results_json['result_count'] > 0:
       Match_Level = 3 #first and last name match with no state
 
   #if no results search on first name only
   if results_json['result_count'] == 0:
-    request = f'https://npiregistry.cms.hhs.gov/api/?number=&enumeration_type=NPI-1&taxonomy_description=&first_name={""}&last_name={Last_Name}&organization_name=&address_purpose=&city=&state={State}&postal_code=&country_code=&limit={Limit}&skip=&version={Version}'
-    r = requests.get(request)
-    results_json = r.json()
+    results_json = client.search({**params, 'first_name': ''})
     if results_json['result_count'] > 0:
       Match_Level = 4 #last name and state match
   
   
   result_count = results_json['result_count']
+  Registry_Error = results_json.get('error', '')
 
   if result_count == 0:
     Match_Level = 0
@@ -143,7 +143,7 @@ for i in range(df.shape[0]):
     add2        = ""
     add3        = ""
 
-    list_for_df = [Rec_ID, First_Name, Last_Name, Middle_Name, Match_Level, result_count, i, NPI, first_name, last_name, middle_name, creditial, specialty1, specialty2, add1, city1, state1, add2, city2, state2, add3, city3, state3]
+    list_for_df = [Rec_ID, First_Name, Last_Name, Middle_Name, Match_Level, result_count, i, NPI, first_name, last_name, middle_name, creditial, specialty1, specialty2, add1, city1, state1, add2, city2, state2, add3, city3, state3, Registry_Error]
 
     main_list.append(list_for_df)
         
@@ -198,13 +198,13 @@ for i in range(df.shape[0]):
           add3   = results_json['results'][j]['addresses'][i]['address_1']
           city3  = results_json['results'][j]['addresses'][i]['city']
         
-      list_for_df = [Rec_ID, First_Name, Last_Name, Middle_Name, Match_Level, result_count, j+1, NPI, first_name, last_name, middle_name, creditial, specialty1, specialty2, add1, city1, state1, add2, city2, state2, add3, city3, state3]
+      list_for_df = [Rec_ID, First_Name, Last_Name, Middle_Name, Match_Level, result_count, j+1, NPI, first_name, last_name, middle_name, creditial, specialty1, specialty2, add1, city1, state1, add2, city2, state2, add3, city3, state3, Registry_Error]
 
       main_list.append(list_for_df)
 
 #create dataframe from list
 if len(main_list) > 0:
-  column_names = ['Row_ID', 'First_Name_Supplied', 'Last_Name_Supplied', 'Middle_Name_Supplied', 'Match_Level', 'Result_Count', 'Result', 'NPI', 'First_Name', 'Last_Name', 'Middle_Name', 'Creditials', 'Specialty_1', 'Specialty_2', 'Address_1', 'City_1', "State_1", 'Address_2', 'City_2', "State_2", 'Address_3', 'City_3', "State_3"]
+  column_names = ['Row_ID', 'First_Name_Supplied', 'Last_Name_Supplied', 'Middle_Name_Supplied', 'Match_Level', 'Result_Count', 'Result', 'NPI', 'First_Name', 'Last_Name', 'Middle_Name', 'Creditials', 'Specialty_1', 'Specialty_2', 'Address_1', 'City_1', "State_1", 'Address_2', 'City_2', "State_2", 'Address_3', 'City_3', "State_3", 'Registry_Error']
 
   df_reg = pd.DataFrame(main_list, columns=column_names)
   df_reg = df_reg.astype({'Row_ID': 'int'})
@@ -0,0 +1,151 @@
+"""
+Ground truth for the CRH roster: the NPIs a matching run is expected to find, and scoring of
+result DataFrames against it and against each other. Used by compare_outputs.py and by the
+app's NPI comparison panel.
+"""
+
+# -------------------- EXPECTED NPIS --------------------
+# NPIs the CRH roster should match to (as confirmed by hand), in roster order
+CRH_EXPECTED_NPIS = [
+    "1467912576", "1770739559", "1619258381", "1265539993", "1407041312", "1811278195", "1235386517", "1245894286",
+    "1619070836", "1780830158", "1497963599", "1265402374", "1639632656", "1932105541", "1508015082", "1063792828",
+    "1861013005", "1790786432", "1013172279", "1295909786", "1154941409", "1902099963", "1982605614", "1497337794",
+    "1952925224", "1255344644", "1942611546", "1356712657", "1033495130", "1508851759", "1336113414", "1588838809",
+    "1639420995", "1932528874", "1922200427", "1720029770", "1215938766", "1518240720", "1437416807", "1780677708",
+    "1710145008", "1265888242", "1760425243", "1265718118", "1578023727", "1285635912", "1629351838", "1477545085",
+    "1831651827", "1760475875", "1639528375", "1679649933", "1992797500", "1528206166", "1194070904", "1790932119",
+    "1285627216", "1871993642", "1982696506", "1619172871", "1295949279", "1821372004", "1285165597", "1770071136",
+    "1922505866", "1841672110", "1417187345", "1831538149", "1437257797", "1124009832", "1083093942", "1659577799",
+    "1306238100", "1497749808", "1942488358", "1215921606", "1194257535", "1710971049", "1770735607", "1215180922",
+    "1316108871", "1336567494", "1093102451", "1295700920", "1386937696", "1780637421", "1922338276", "1750671228",
+    "1598173684", "1407874563", "1811934987", "1619960630", "1043475080", "1588160709", "1831183227", "1821060146",
+    "1326509969", "1972624120", "1265429922", "1922031962", "1013943547", "1144202979", "1326247453", "1083681852",
+    "1164653010", "1578805552", "1356796312", "1174563969", "1912056623", "1790733186", "1992771596", "1164415188",
+    "1255527008", "1578652392", "1609172360", "1427382399", "1598999484", "1124347612", "1316574817", "1053708073",
+    "1760475792", "1376639088", "1730479510", "1265403208", "1497863195", "1760689590", "1659667772", "1851851307",
+    "1700271699", "1417120031", "1467807776", "1265615918", "1326144650", "1972761591", "1295153138", "1063825792",
+    "1003816604", "1548423809", "1982101614", "1598771529", "1124188925", "1235581174", "1417158072", "1447834601",
+    "1972959831", "1790066454", "1023163771", "1053629956", "1871659136", "1538466438", "1508304155", "1093156028",
+    "1215125588", "1154587566", "1699208454", "1396945903", "1093264822", "1275655565", "1750763504", "1699138974",
+    "1366945180", "1134120967", "1114123742", "1255509006", "1194713347", "1013000629", "1750606711", "1184611840",
+    "1013412808", "1952310468", "1215465109", "1225235385", "1265750343", "1578739611", "1043555352", "1013235340",
+    "1982691648", "1407105158", "1023270253", "1407152341", "1013995620", "1548578594", "1750524625", "1861402851",
+    "1134110125", "1275813651", "1619174240", "1619159852", "1558929877", "1134106107", "1417025321", "1336406644",
+    "1598051484", "1942582705", "1164416897", "1508958299", "1639160187", "1508866096", "1013536606", "1639137029",
+    "1518386994", "1427030691", "1538141726", "1891884946", "1649836925", "1780940049", "1629225651", "1518128594",
+    "1770557860", "1790767762", "1699942441", "1578970414", "1316273493", "1912294448", "1013336551", "1194725168",
+    "1841607744", "1508866187", "1982164935", "1417158023", "1003190711", "1457843716", "1033191226", "1609089457",
+    "1295717486", "1518311307", "1679573646", "1760600431", "1689912669", "1669092672", "1063412013", "1518112788",
+    "1285634345", "1285773200", "1013288273", "1528598224", "1922363670", "1215919030", "1649220740", "1346223591",
+    "1811217714", "1235492703", "1477692929", "1144463597", "1588914600", "1255714978", "1831699842", "1609877331",
+    "1891769774", "1962445684", "1366528739", "1336216613", "1538463799", "1467799163", "1356001010", "1740547637",
+    "1053916353", "1720649395", "1770830432", "1053634139", "1336131952", "1568798932", "1346693546", "1104207893",
+    "1336263672", "1356689657", "1568762516", "1164944294", "1306927314", "1942410444", "1275796195", "1689988297",
+    "1215256789", "1629698717", "1821700436", "1710351150", "1467859512", "1396906624", "1821860883", "1134510258",
+    "1033675863", "1871228023", "1588680623", "1275961260", "1932580081", "1255912523", "1386011385", "1295134013",
+    "1730119439", "1801266994", "1205322369", "1790462216", "1346881836", "1134725575", "1154861060", "1780978197",
+    "1255473666", "1720462369", "1649894338", "1063784908", "1831655026", "1427380138", "1114661832", "1205227352",
+    "1174066989", "1861681926", "1134761679", "1386229557", "1538141494", "1366807109", "1316707979", "1134224470",
+    "1417242413", "1205445384", "1477592863", "1669404216", "1871575019", "1710208814", "1437193521", "1841044278",
+    "1033996194", "1043838246", "1568832665", "1598199176", "1831610369", "1437663424", "1518186840", "1134198880",
+    "1285708222", "1568550531", "1386759512", "1982027538", "1467656496", "1902087208", "1083697254", "1619167822",
+    "1144360884", "1043599236", "1831299957", "1487899241", "1972771681", "1144503053", "1447566617", "1053307512",
+    "1427382399", "1013336551", "1083093942", "1659667772", "1043475080", "1982101614", "1366945180", "1407105158",
+    "1831699842", "1619258381", "1750671228", "1609172360", "1780969790", "1750607602", "1083176788", "1346421963",
+    "1467618678", "1649767559", "1689619710", "1376515155", "1053554121", "1275820755", "1689836207", "1386064806",
+    "1104130947", "1700078649", "1659306322", "1922409994", "1053961292", "1386377265", "1134208879", "1134368608",
+    "1568453546", "1386718567", "1154316131", "1770657330", "1679942841", "1144431396", "1184003147", "1033304589",
+    "1922458249", "1366079717", "1114166220", "1881700177", "1952493538", "1588833081", "1548518350", "1508106758",
+    "1780121855", "1992787972", "1821528167", "1366513749", "1356458277", "1821363334", "1750627683", "1689931719",
+    "1962497115", "1851829485", "1225515448", "1871124487", "1912015397", "1831392034", "1619557584", "1033985338",
+    "1639515497", "1033101951", "1770275562", "1902309164", "1851446116", "1497210272", "1053629808", "1598920530",
+    "1407474604", "1578271474", "1255827929", "1063097814", "1013040690", "1740314533", "1114659851", "1528192804",
+    "1366716094", "1952383069", "1154402139", "1760555312", "1780121855", "1992787972", "1225097793", "1669739884",
+    "1518007368", "1962991851", "1518163039", "1851553259", "1952767535", "1053336727", "1043303274", "1174941967",
+    "1538585716", "1013197300", "1710979174", "1932884939", "1043310634", "1427596337", "1285615120", "1801183215",
+    "1902000730", "1184986051", "1366999153", "1225369218", "1649698259", "1316276827", "1366590192", "1467035998",
+    "1992384218", "1851393771", "1265435655", "1124050497", "1942055918", "1659451128", "1912033424", "1427881531",
+    "1164208385", "1639167679", "1437860566", "1982985610", "1033824222", "1093958613", "1730641606", "1093028102",
+    "1841674926", "1467796268", "1831378413", "1003194689", "1942294335", "1336349984", "1245959253", "1356996813",
+    "1760128805", "1902102387", "1982943957"
+]
+# Listed above but not actually CRH providers (namesakes, or providers who left)
+EXCLUDED_NPIS = {
+    "1336349984", "1467796268", "1831378413", "1003194689", "1033985338", "1033824222", "1730641606",
+    "1093028102", "1841674926", "1053961292", "1386377265", "1063097814", "1093264822", "1104130947",
+    "1154402139", "1639515497", "1649767559", "1659306322", "1821363334", "1831392034", "1851393771",
+    "1467035998", "1366590192", "1881700177", "1902102387", "1982943957", "1356996813", "1245959253",
+    "1952767535", "1982985610", "1437860566", "1164208385", "1427881531", "1346421963", "1427596337",
+    "1578271474", "1851446116"
+}
+EXPECTED_NPIS = frozenset(npi for npi in CRH_EXPECTED_NPIS if npi not in EXCLUDED_NPIS)
+# Exports from before match levels were labeled numbered them in strategy order
+MATCH_LEVEL_CODES = {"0": "No Match", "1": "Best", "2": "Good", "3": "Potential", "4": "Limited Potential"}
+
+
+def normalize_npi(value):
+    """An NPI as a digit string, or "" for no match (a CSV reader may have parsed it as a float)."""
+    text = str(value).strip() if value is not None else ""
+    if text.endswith(".0"):
+        text = text[:-2]
+    return text if text.isdigit() else ""
+
+
+def supplied_name(first, last):
+    return " ".join(f"{first} {last}".split()).title()
+
+
+def result_npis(result_df):
+    return {npi for npi in map(normalize_npi, result_df["NPI"]) if npi}
+
+
+def score_npis(result_df, expected=EXPECTED_NPIS):
+    """Recall and precision of a result DataFrame's NPIs against the expected ones."""
+    found = result_npis(result_df)
+    in_both = found & expected
+    return {
+        "found": len(found),
+        "expected": len(expected),
+        "in_both": len(in_both),
+        "recall": round(len(in_both) / len(expected), 4) if expected else 0.0,
+        "precision": round(len(in_both) / len(found), 4) if found else 0.0,
+        "missing": sorted(expected - found),
+        "unexpected": sorted(found - expected),
+    }
+
+
+def matches_by_supplied_name(result_df):
+    """{supplied name: (match levels, NPIs)} over the rows of a result DataFrame."""
+    matches = {}
+    df = result_df.fillna("")
+    for first, last, level, npi in zip(df["First_Name_Supplied"], df["Last_Name_Supplied"], df["Match_Level"],
+                                       df["NPI"]):
+        levels, npis = matches.setdefault(supplied_name(first, last), (set(), set()))
+        levels.add(MATCH_LEVEL_CODES.get(str(level).strip(), str(level).strip()))
+        npi = normalize_npi(npi)
+        if npi:
+            npis.add(npi)
+    return matches
+
+
+def row_diffs(result_df, reference_df, expected=EXPECTED_NPIS):
+    """
+    For every supplied name matched differently in result_df than in reference_df: the NPIs it
+    lost and gained, the lost ones that were expected, and both match levels.
+    """
+    result, reference = matches_by_supplied_name(result_df), matches_by_supplied_name(reference_df)
+    diffs = []
+    for name in sorted(result.keys() | reference.keys()):
+        levels, npis = result.get(name, (set(), set()))
+        reference_levels, reference_npis = reference.get(name, (set(), set()))
+        if levels == reference_levels and npis == reference_npis:
+            continue
+        diffs.append({
+            "supplied_name": name,
+            "match_level": ", ".join(sorted(levels)) or "(missing)",
+            "reference_match_level": ", ".join(sorted(reference_levels)) or "(missing)",
+            "lost": sorted(reference_npis - npis),
+            "gained": sorted(npis - reference_npis),
+            "lost_expected": sorted((reference_npis - npis) & expected),
+        })
+    return diffs
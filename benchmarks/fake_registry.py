@@ -0,0 +1,256 @@
+"""
+Local stand-in for the NPI Registry API, for benchmarks and offline testing. Providers are
+canned from example_output.csv (the registry records the CRH roster matched), padded with
+deterministic same-surname providers so the looser strategies and pagination have work to do.
+
+    python -m benchmarks.fake_registry --port 8765 --latency 0.05 --error-rate 0.02
+    NPI_REGISTRY_URL=http://127.0.0.1:8765/api/ python -m npi_matcher match roster.csv -o out.csv
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from hospitals import HOSPITAL_FILE
+from npi_registry import REGISTRY_MAX_SKIP, REGISTRY_PAGE_LIMIT
+
+# -------------------- CONFIG & CONSTANTS --------------------
+EXAMPLE_OUTPUT_FILE = "example_output.csv"
+ROSTER_FILE = "2024-2025 CRH Roster Clean - Copy(All) (1).csv"
+DEFAULT_SEED = 7
+DEFAULT_NOISE_PER_SURNAME = 2
+# Surnames from the roster padded to several registry pages, like the real registry's Shahs and Singhs
+COMMON_SURNAMES = {"Khan": 650, "Kumar": 650, "Shah": 650, "Singh": 650}
+NOISE_STATES = ["NY", "NY", "NY", "NJ", "CT", "PA", "FL", "CA", "TX"]
+NOISE_TAXONOMIES = [
+    "Internal Medicine", "Internal Medicine, Hospitalist", "Family Medicine", "Pediatrics",
+    "Obstetrics & Gynecology", "Psychiatry & Neurology, Psychiatry", "Emergency Medicine",
+    "Physician Assistant, Medical", "Nurse Practitioner, Family", "Internal Medicine, Cardiovascular Disease",
+]
+
+
+def canned_records(example_path=EXAMPLE_OUTPUT_FILE, roster_path=ROSTER_FILE, hospital_path=HOSPITAL_FILE,
+                   noise_per_surname=DEFAULT_NOISE_PER_SURNAME, common_surnames=None, seed=DEFAULT_SEED):
+    """
+    Registry-shaped provider records: every NPI in example_output.csv as it was matched, plus
+    `noise_per_surname` other providers for each roster surname and the COMMON_SURNAMES padding.
+    The same arguments always give the same records, in the same order.
+    """
+    rng = random.Random(seed)
+    example = pd.read_csv(example_path, dtype=str).fillna("")
+    roster = pd.read_csv(roster_path, dtype=str, encoding="latin-1").fillna("")
+    hospitals = pd.read_csv(hospital_path, dtype=str).fillna("")[["Address", "City", "State"]].values.tolist()
+
+    records = {}
+    for row in example[example["NPI"] != ""].to_dict("records"):
+        records.setdefault(row["NPI"], {
+            "number": row["NPI"],
+            "enumeration_type": "NPI-1",
+            "basic": {
+                "first_name": row["First_Name"],
+                "last_name": row["Last_Name"],
+                "middle_name": row["Middle_Name"],
+                "credential": row["Creditials"],
+            },
+            "taxonomies": [{"desc": row[c]} for c in ("Specialty_1", "Specialty_2") if row[c]],
+            "addresses": [
+                {"address_purpose": "LOCATION", "address_1": row[f"Address_{i}"], "city": row[f"City_{i}"],
+                 "state": row[f"State_{i}"]}
+                for i in (1, 2, 3) if row[f"Address_{i}"] or row[f"State_{i}"]
+            ],
+            "other_names": [],
+        })
+
+    first_names = sorted({name.strip().title() for name in roster["First_Name"] if name.strip()})
+    next_npi = 1999000000
+
+    def noise(last_name):
+        nonlocal next_npi
+        next_npi += 1
+        state = rng.choice(NOISE_STATES)
+        in_state = [h for h in rng.sample(hospitals, 20) if h[2].strip().upper() == state]
+        address, city, _ = in_state[0] if in_state else rng.choice(hospitals)
+        return {
+            "number": str(next_npi),
+            "enumeration_type": "NPI-1",
+            "basic": {"first_name": rng.choice(first_names).upper(), "last_name": last_name.upper(),
+                      "middle_name": "", "credential": rng.choice(["MD", "DO", "PA", "NP"])},
+            "taxonomies": [{"desc": desc} for desc in rng.sample(NOISE_TAXONOMIES, rng.randint(1, 2))],
+            "addresses": [{"address_purpose": "LOCATION", "address_1": address, "city": city, "state": state}],
+            "other_names": [],
+        }
+
+    noisy = [noise(name.strip()) for name in sorted({n.strip() for n in roster["Last_Name"] if n.strip()})
+             for _ in range(noise_per_surname)]
+    padded = [noise(name) for name, count in (common_surnames or COMMON_SURNAMES).items() for _ in range(count)]
+    return list(records.values()) + noisy + padded
+
+
+class FakeRegistry:
+    """
+    In-memory registry over a list of records. search() answers registry query parameters the
+    way the API does (exact case-insensitive names, any address in `state`, skip/limit pages);
+    query/query_many also make it usable as RegistryLookup's local index, with no HTTP at all.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self._by_last = {}
+        self._by_first = {}
+        for i, record in enumerate(records):
+            self._by_last.setdefault(record["basic"]["last_name"].strip().lower(), []).append(i)
+            self._by_first.setdefault(record["basic"]["first_name"].strip().lower(), []).append(i)
+
+    def matches(self, first, last, state):
+        first, last, state = first.strip().lower(), last.strip().lower(), state.strip().upper()
+        if last:
+            candidates = self._by_last.get(last, [])
+        else:
+            candidates = self._by_first.get(first, [])
+        return [
+            self.records[i] for i in candidates
+            if (not first or self.records[i]["basic"]["first_name"].strip().lower() == first)
+            and (not state or any(a["state"].upper() == state for a in self.records[i]["addresses"]))
+        ]
+
+    def search(self, params):
+        """The registry's JSON body for one request's query parameters."""
+        first, last = params.get("first_name", ""), params.get("last_name", "")
+        try:
+            skip, limit = int(params.get("skip", 0) or 0), int(params.get("limit", 10) or 10)
+        except ValueError:
+            return {"Errors": [{"description": "skip and limit must be numbers"}]}
+        if not (first.strip() or last.strip()):
+            return {"Errors": [{"description": "No valid search criteria provided"}]}
+        if limit > REGISTRY_PAGE_LIMIT or skip > REGISTRY_MAX_SKIP:
+            return {"Errors": [{"description": f"limit must be <= {REGISTRY_PAGE_LIMIT} and skip <= {REGISTRY_MAX_SKIP}"}]}
+        results = self.matches(first, last, params.get("state", ""))[skip:skip + limit]
+        return {"result_count": len(results), "results": results}
+
+    def query(self, first, last, state, version=2.1, max_results=500):
+        results = self.matches(first, last, state)[:max_results]
+        return {"results": results, "result_count": len(results)}
+
+    def query_many(self, queries, version=2.1, max_results=500):
+        return [self.query(first, last, state, version, max_results) for first, last, state in queries]
+
+
+class FakeRegistryServer:
+    """
+    Serves a FakeRegistry over HTTP on a background thread, with injected latency (plus up to
+    `jitter` seconds), 503 errors and 429 throttling at the given rates. Counts every request.
+    """
+
+    def __init__(self, registry, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, seed=DEFAULT_SEED):
+        self.registry = registry
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query, keep_blank_values=True).items()}
+                status, body, headers = server.respond(params)
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def respond(self, params):
+        """(status, body, headers) for one request, after the injected latency."""
+        with self._lock:
+            self.requests += 1
+            roll = self._rng.random()
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            return 429, "Too Many Requests", {"Content-Type": "text/plain", "Retry-After": "1"}
+        if roll < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 503, "<html>Service Unavailable</html>", {"Content-Type": "text/html"}
+        return 200, json.dumps(self.registry.search(params)), {"Content-Type": "application/json"}
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "throttled": self.throttled}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-registry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the NPI Registry API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra random seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+
+    registry = FakeRegistry(canned_records(seed=args.seed))
+    server = FakeRegistryServer(registry, args.host, args.port, args.latency, args.jitter, args.error_rate,
+                                args.throttle_rate, args.seed)
+    print(f"Serving {len(registry.records)} providers at {server.url}", file=sys.stderr)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Benchmark suite: microbenchmarks of the matching and hospital stages and an end-to-end roster
+run against the fake registry server. Prints throughput and latency, can save them as the
+baseline, and exits with status 1 when a result is worse than the baseline by more than the
+threshold.
+
+    python -m benchmarks.run --save-baseline       # once, on the machine that runs the suite
+    python -m benchmarks.run                       # compare against benchmarks/baseline.json
+    python -m benchmarks.run --only micro --threshold 0.5
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from benchmarks.fake_registry import ROSTER_FILE, FakeRegistry, FakeRegistryServer, canned_records
+from hospitals import HospitalIndex, HospitalMatchCache, load_hospital_df
+from npi_matcher import (
+    STRICTNESS_LABELS, CandidatePool, RegistryLookup, load_roster, match_provider, match_roster,
+)
+from npi_registry import DEFAULT_MAX_CONCURRENCY
+from rate_limit import DEFAULT_MAX_RATE
+from run_metrics import RunMetrics
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25  # fail when a result is more than 25% worse than its baseline
+DEFAULT_REPEATS = 3
+DEFAULT_LIMIT = 5
+
+
+def result(name, value, unit, better="lower"):
+    # better=None: reported only, too noisy to fail a run on. Plain int/float, so numpy
+    # counts and timings stay JSON serializable
+    value = int(value) if float(value).is_integer() else round(float(value), 6)
+    return {"name": name, "value": value, "unit": unit, "better": better}
+
+
+def write_json(path, data):
+    # Atomic, so a failed write never leaves a truncated baseline behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def best_of(fn, repeats):
+    """Fastest of `repeats` calls of fn (the least disturbed by the rest of the machine), and its return value."""
+    best, value = None, None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+# -------------------- MICROBENCHMARKS --------------------
+def bench_load_hospital_df(repeats):
+    seconds, df = best_of(load_hospital_df, repeats)
+    return [result("load_hospital_df_seconds", seconds, "s")], df
+
+
+def bench_hospital_lookup(hospital_df, records, repeats):
+    """HospitalIndex.find (one address at a time) and find_many (batched), with no match cache."""
+    lookups = [
+        (a["address_1"], a["city"], a["state"]) for record in records for a in record["addresses"] if a["address_1"]
+    ]
+    index = HospitalIndex.from_df(hospital_df)
+    for block_key in index.block_ranges:
+        index._block(block_key)  # decode every block up front, so only scoring is timed
+    find_seconds, _ = best_of(lambda: [index.find(*lookup) for lookup in lookups], repeats)
+    find_many_seconds, _ = best_of(lambda: index.find_many(lookups), repeats)
+    return [
+        result("hospital_find_per_second", len(lookups) / find_seconds, "lookups/s", "higher"),
+        result("hospital_find_many_per_second", len(lookups) / find_many_seconds, "lookups/s", "higher"),
+    ]
+
+
+def bench_match_provider(registry, roster_df, strictness, repeats):
+    """
+    match_provider over every roster row with a warm candidate pool, so only matching is timed:
+    the pool is filled from the in-process fake registry by a first untimed pass.
+    """
+    search_type = STRICTNESS_LABELS[strictness]
+    rows = roster_df.to_dict("records")
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    for row in rows:
+        match_provider(row, "", DEFAULT_LIMIT, search_type, pool)
+
+    def run():
+        latencies = []
+        for row in rows:
+            started = time.perf_counter()
+            match_provider(row, "", DEFAULT_LIMIT, search_type, pool)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    seconds, latencies = best_of(run, repeats)
+    name = f"match_provider_{strictness.lower().replace(' ', '_')}"
+    return [
+        result(f"{name}_rows_per_second", len(rows) / seconds, "rows/s", "higher"),
+        result(f"{name}_p95_ms", percentile(latencies, 0.95) * 1000, "ms", better=None),
+    ]
+
+
+# -------------------- END TO END --------------------
+def bench_end_to_end(registry, roster_df, hospital_df, strictness, latency, jitter, error_rate, max_concurrency,
+                     max_rate):
+    """A whole match_roster run against the fake registry over HTTP, with the response cache off."""
+    with FakeRegistryServer(registry, latency=latency, jitter=jitter, error_rate=error_rate) as server:
+        metrics = RunMetrics()
+        started = time.perf_counter()
+        result_df = match_roster(
+            roster_df, [], DEFAULT_LIMIT, STRICTNESS_LABELS[strictness],
+            {
+                "backend": "api",
+                "use_cache": False,
+                "registry_url": server.url,
+                "max_concurrency": max_concurrency,
+                "max_rate": max_rate,
+            },
+            hospital_index=HospitalIndex.from_df(hospital_df, HospitalMatchCache()),
+            metrics=metrics,
+        )
+        seconds = time.perf_counter() - started
+        server_stats = server.stats()
+    row_seconds = metrics.snapshot()["histograms"].get("row_seconds", [{}])[0]
+    matched = result_df.loc[result_df["Match_Level"] != "No Match", "First_Name_Supplied"].count()
+    name = f"end_to_end_{strictness.lower().replace(' ', '_')}"
+    return [
+        result(f"{name}_seconds", seconds, "s"),
+        result(f"{name}_rows_per_second", len(roster_df) / seconds, "rows/s", "higher"),
+        result(f"{name}_row_mean_ms", row_seconds.get("mean", 0.0) * 1000, "ms"),
+        result(f"{name}_registry_requests", server_stats["requests"], "requests"),
+        result(f"{name}_matched_result_rows", matched, "rows", "higher"),
+    ]
+
+
+# -------------------- BASELINE --------------------
+def compare(results, baseline, threshold):
+    """Annotates results with their change against the baseline; returns those worse than the threshold."""
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if not base or r["better"] is None:
+            continue
+        r["baseline"] = base
+        r["change"] = (r["value"] - base) / base
+        if (r["change"] > threshold) if r["better"] == "lower" else (r["change"] < -threshold):
+            regressions.append(r)
+    return regressions
+
+
+def print_results(results, regressions):
+    width = max(len(r["name"]) for r in results)
+    for r in results:
+        line = f"{r['name']:<{width}}  {r['value']:>12.3f} {r['unit']:<10}"
+        if "change" in r:
+            worse = r in regressions
+            line += f"  {r['change']:+7.1%} vs baseline {r['baseline']:.3f}" + ("  REGRESSION" if worse else "")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the NPI matcher against a local fake registry.")
+    parser.add_argument("--only", choices=["micro", "e2e"], help="Run only the microbenchmarks or the end-to-end run")
+    parser.add_argument("--roster", default=ROSTER_FILE)
+    parser.add_argument("--strictness", nargs="*", default=["Best", "Potential"], choices=list(STRICTNESS_LABELS))
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake registry latency per request (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake registry requests failing with 503")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("-o", "--output", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    registry = FakeRegistry(canned_records())
+    roster_df = load_roster(args.roster)
+    results, hospital_df = bench_load_hospital_df(args.repeats)
+    if args.only != "e2e":
+        results += bench_hospital_lookup(hospital_df, registry.records, args.repeats)
+        for strictness in args.strictness:
+            results += bench_match_provider(registry, roster_df, strictness, args.repeats)
+    if args.only != "micro":
+        for strictness in args.strictness:
+            results += bench_end_to_end(registry, roster_df, hospital_df, strictness, args.latency, args.jitter,
+                                        args.error_rate, args.max_concurrency, args.max_rate)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+    print_results(results, regressions)
+    report = {"machine": platform.node(), "python": platform.python_version(), "created": time.time(),
+              "results": {r["name"]: r["value"] for r in results}}
+    if args.output:
+        write_json(args.output, {**report, "details": results})
+    if args.save_baseline:
+        write_json(args.baseline, report)
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} result(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
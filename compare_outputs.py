@@ -1,19 +1,203 @@
+"""
+Accuracy-and-speed regression harness. `run` matches a fixed roster at each strictness, scores
+the results against the expected CRH NPIs (accuracy.py) and, next to a saved baseline, shows
+recall, precision, wall-clock time and registry queries side by side, plus every supplied name
+whose matches changed. It exits with status 1 when a run lost a match the baseline had, so a
+performance change is only accepted when it provably finds the same providers.
+
+    python compare_outputs.py run --record crh.cassette.json.gz --save-baseline   # once, on a known-good tree
+    python compare_outputs.py run --replay crh.cassette.json.gz                   # after a change
+    python compare_outputs.py diff test_output.csv example_output.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
 import pandas as pd
 
-# Load your app's output and the example output
-your_output = pd.read_csv("test_output.csv")
-example_output = pd.read_csv("example_output.csv")
-
-# Optional: Sort both DataFrames by key columns for consistent comparison
-sort_cols = ["First_Name_Supplied", "Last_Name_Supplied", "NPI"]  # adjust as needed
-your_output = your_output.sort_values(by=sort_cols).reset_index(drop=True)
-example_output = example_output.sort_values(by=sort_cols).reset_index(drop=True)
-
-# Compare DataFrames
-if your_output.equals(example_output):
-    print("✅ The outputs match exactly!")
-else:
-    print("❌ The outputs do NOT match.")
-    # Show differences
-    diff = your_output.compare(example_output)
-    print(diff)
\ No newline at end of file
+from accuracy import row_diffs, score_npis
+from npi_matcher import STRICTNESS_LABELS, load_roster, match_roster
+from npi_registry import DEFAULT_MAX_CONCURRENCY
+from rate_limit import DEFAULT_MAX_RATE
+from run_metrics import RunMetrics
+
+# -------------------- CONFIG & CONSTANTS --------------------
+ROSTER_FILE = "2024-2025 CRH Roster Clean - Copy(All) (1).csv"
+DEFAULT_BASELINE_DIR = "accuracy_baseline"
+DEFAULT_LIMIT = 5
+
+
+def read_output(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path).astype(str)
+    if path.endswith((".xls", ".xlsx")):
+        return pd.read_excel(path, dtype=str).fillna("")
+    return pd.read_csv(path, dtype=str).fillna("")
+
+
+def slug(strictness):
+    return strictness.lower().replace(" ", "_")
+
+
+# -------------------- REPORTING --------------------
+def side_by_side(value, baseline, fmt):
+    text = format(value, fmt)
+    if baseline is None:
+        return text
+    return f"{text} ({format(baseline, fmt)})"
+
+
+def print_summary(runs, baseline):
+    print("strictness          recall            precision         seconds           registry queries  rows changed")
+    for strictness, run in runs.items():
+        base = baseline.get(strictness, {})
+        print(
+            f"{strictness:<20}"
+            f"{side_by_side(run['recall'], base.get('recall'), '.4f'):<18}"
+            f"{side_by_side(run['precision'], base.get('precision'), '.4f'):<18}"
+            f"{side_by_side(run['seconds'], base.get('seconds'), '.1f'):<18}"
+            f"{side_by_side(run['registry_queries'], base.get('registry_queries'), 'd'):<18}"
+            f"{run['rows_changed'] if run['rows_changed'] is not None else '-'}"
+        )
+    if baseline:
+        print("(baseline values in parentheses)")
+
+
+def print_diffs(title, diffs):
+    if not diffs:
+        return
+    print(f"\n{title}: {len(diffs)} supplied name(s) matched differently")
+    for diff in diffs:
+        line = f"  {diff['supplied_name']}: {diff['reference_match_level']} -> {diff['match_level']}"
+        if diff["lost"]:
+            line += f"; lost {', '.join(diff['lost'])}"
+        if diff["lost_expected"]:
+            line += " (expected!)"
+        if diff["gained"]:
+            line += f"; gained {', '.join(diff['gained'])}"
+        print(line)
+
+
+# -------------------- COMMANDS --------------------
+def run_strictness(roster_df, strictness, args):
+    lookup_config = {
+        "backend": "api",
+        "max_concurrency": args.max_concurrency,
+        "max_rate": args.max_rate,
+        "use_cache": args.cache,
+        "cassette_mode": "record" if args.record else "replay" if args.replay else "passthrough",
+    }
+    if args.record or args.replay:
+        lookup_config["cassette_path"] = args.record or args.replay
+    metrics = RunMetrics()
+    started = time.perf_counter()
+    result_df = match_roster(roster_df, [], args.limit, STRICTNESS_LABELS[strictness], lookup_config,
+                             processes=args.processes, metrics=metrics)
+    seconds = time.perf_counter() - started
+    score = score_npis(result_df)
+    return result_df, {
+        "seconds": round(seconds, 3),
+        "registry_queries": metrics.total("registry_queries"),
+        "registry_pages": metrics.total("registry_pages"),
+        "cache_hits": metrics.total("cache_hits"),
+        "result_rows": len(result_df),
+        **{k: score[k] for k in ("found", "in_both", "recall", "precision")},
+        "missing": score["missing"],
+    }
+
+
+def run(args):
+    roster_df = load_roster(args.roster)
+    report_path = os.path.join(args.baseline, "report.json")
+    baseline = {}
+    if os.path.exists(report_path) and not args.save_baseline:
+        with open(report_path, encoding="utf-8") as f:
+            baseline = json.load(f)["runs"]
+
+    runs, failures = {}, []
+    for strictness in args.strictness:
+        print(f"Matching {len(roster_df)} rows at {strictness}...", file=sys.stderr)
+        result_df, summary = run_strictness(roster_df, strictness, args)
+        baseline_output = os.path.join(args.baseline, f"{slug(strictness)}.csv")
+        diffs = None
+        if strictness in baseline and os.path.exists(baseline_output):
+            diffs = row_diffs(result_df, read_output(baseline_output))
+            lost = [d for d in diffs if d["lost"]]
+            if lost:
+                failures.append(f"{strictness}: {len(lost)} supplied name(s) lost matches")
+            if summary["recall"] < baseline[strictness]["recall"]:
+                failures.append(f"{strictness}: recall fell to {summary['recall']:.4f}")
+        summary["rows_changed"] = len(diffs) if diffs is not None else None
+        summary["diffs"] = diffs or []
+        runs[strictness] = summary
+        if args.save_baseline:
+            os.makedirs(args.baseline, exist_ok=True)
+            result_df.to_csv(baseline_output, index=False)
+
+    print_summary(runs, baseline)
+    for strictness, summary in runs.items():
+        print_diffs(strictness, summary["diffs"])
+    report = {"roster": args.roster, "created": time.time(), "runs": runs}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    if failures:
+        print("\n".join(failures), file=sys.stderr)
+        return 1
+    return 0
+
+
+def diff(args):
+    """Scores two existing result files side by side and lists the names they match differently."""
+    result_df, reference_df = read_output(args.result), read_output(args.reference)
+    result_score, reference_score = score_npis(result_df), score_npis(reference_df)
+    for key in ("found", "in_both", "recall", "precision"):
+        print(f"{key:<10} {result_score[key]!s:>10} {reference_score[key]!s:>10}")
+    print(f"({args.result} vs {args.reference})")
+    diffs = row_diffs(result_df, reference_df)
+    print_diffs(args.result, diffs)
+    if not diffs:
+        print("✅ Both outputs match the same NPIs for every supplied name.")
+    return 1 if diffs else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check NPI matcher accuracy and speed against expected NPIs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Match the roster at each strictness and compare to the baseline")
+    run_parser.add_argument("--roster", default=ROSTER_FILE)
+    run_parser.add_argument("--strictness", nargs="*", default=list(STRICTNESS_LABELS), choices=list(STRICTNESS_LABELS))
+    run_parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    run_parser.add_argument("--processes", type=int, default=1)
+    run_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    run_parser.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE)
+    run_parser.add_argument("--cache", action="store_true",
+                            help="Use the registry response cache (off by default, so registry calls are comparable)")
+    cassette = run_parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE", help="Record the runs' registry traffic to this archive")
+    cassette.add_argument("--replay", metavar="CASSETTE", help="Replay the runs from a recorded archive, with no network")
+    run_parser.add_argument("--baseline", default=DEFAULT_BASELINE_DIR, help="Directory of the baseline outputs")
+    run_parser.add_argument("--save-baseline", action="store_true", help="Store these runs as the new baseline")
+    run_parser.add_argument("-o", "--output", help="Also write the report to this JSON file")
+
+    diff_parser = subparsers.add_parser("diff", help="Compare two existing result files")
+    diff_parser.add_argument("result", nargs="?", default="test_output.csv")
+    diff_parser.add_argument("reference", nargs="?", default="example_output.csv")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        if args.record and args.processes > 1:
+            parser.error("--record needs --processes 1")
+        return run(args)
+    return diff(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import gzip
+import io
+import math
+
+import xlsxwriter
+
+# -------------------- CONFIG & CONSTANTS --------------------
+EXCEL_MAX_ROWS = 1048576  # a worksheet's row limit, header included
+
+
+def _cell(value):
+    # xlsxwriter writes None as an empty cell, but would write NaN as an Excel error
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def write_excel(df, target, sheet_name="Results"):
+    """
+    Writes df to an .xlsx file (a path or a binary file object) with xlsxwriter's constant
+    memory mode: rows are streamed to the worksheet one at a time instead of being held as
+    a whole workbook, so memory stays flat however many result rows there are.
+    """
+    if len(df) >= EXCEL_MAX_ROWS:
+        raise ValueError(f"{len(df)} rows do not fit in one Excel worksheet; export CSV or Parquet instead")
+    workbook = xlsxwriter.Workbook(target, {"constant_memory": True, "strings_to_numbers": False,
+                                            "strings_to_formulas": False, "strings_to_urls": False})
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], workbook.add_format({"bold": True}))
+    for row_number, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_number, 0, [_cell(value) for value in row])
+    workbook.close()
+
+
+def excel_bytes(df):
+    output = io.BytesIO()
+    write_excel(df, output)
+    return output.getvalue()
+
+
+def csv_gz_bytes(df):
+    return gzip.compress(df.to_csv(index=False).encode("utf-8"), compresslevel=6)
+
+
+def parquet_bytes(df):
+    output = io.BytesIO()
+    df.to_parquet(output, index=False)
+    return output.getvalue()
+
+
+# label: (builder, file extension, MIME type)
+EXPORT_FORMATS = {
+    "Excel": (excel_bytes, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV (gzip)": (csv_gz_bytes, "csv.gz", "application/gzip"),
+    "Parquet": (parquet_bytes, "parquet", "application/vnd.apache.parquet"),
+}
@@ -0,0 +1,329 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import string
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+# -------------------- CONFIG & CONSTANTS --------------------
+HOSPITAL_FILE = "Filtered_Hospitals.csv"
+MATCH_CACHE_FILE = "Filtered_Hospitals.matches.json.gz"
+HOSPITAL_ARTIFACT_DIR = "Filtered_Hospitals.index"
+ARTIFACT_VERSION = 1
+ARTIFACT_ARRAYS = ["names", "addresses", "cities", "states", "block_states", "block_cities", "block_starts", "block_ends"]
+DEFAULT_THRESHOLD = 70
+DEFAULT_MATCH_CACHE_SIZE = 100000
+
+
+def normalize_address(addr):
+    addr = addr.upper().strip()
+    addr = addr.translate(str.maketrans('', '', string.punctuation))
+    addr = " ".join(addr.split())
+    return addr
+
+
+def load_hospital_df(path=HOSPITAL_FILE):
+    df = pd.read_csv(path, dtype=str)
+
+    # Fill NaNs and normalize key fields
+    df["Hospital"] = df["Hospital"].fillna("").str.strip()
+    df["Address"] = df["Address"].fillna("").str.upper().str.strip()
+    df["City"] = df["City"].fillna("").str.upper().str.strip()
+    df["State"] = df["State"].fillna("").str.upper().str.strip()
+
+    # Normalize the street address (and street + city) once, for fuzzy comparison
+    df["Norm_Address"] = df["Address"].apply(normalize_address)
+    df["Norm_Address_City"] = (df["Address"] + " " + df["City"]).apply(normalize_address)
+
+    return df
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class HospitalMatchCache:
+    """
+    Bounded LRU of address lookups -> hospital name ("" for no match), shared by all worker
+    threads. With a path it is saved to disk between runs, tagged with the hospital file's
+    checksum so it is thrown away when that file changes.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MATCH_CACHE_SIZE, path=None, checksum=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.checksum = checksum
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return  # unreadable cache file; start empty and overwrite it on the next save
+        if saved.get("checksum") != self.checksum:
+            return
+        for key, hospital in saved.get("entries", [])[-self.max_entries:]:
+            self._entries[tuple(key)] = hospital
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[list(key), hospital] for key, hospital in self._entries.items()]
+        tmp_path = self.path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"checksum": self.checksum, "entries": entries}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """The cached hospital name for key, or None if the lookup has not been done yet."""
+        with self._lock:
+            hospital = self._entries.get(key)
+            if hospital is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return hospital
+
+    def set(self, key, hospital):
+        with self._lock:
+            self._entries[key] = hospital
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+def encode(values):
+    # Fixed-width UTF-8 byte strings, so the arrays can be memory-mapped
+    return np.array([str(v).encode("utf-8") for v in values], dtype=bytes)
+
+
+def decode(values):
+    return [v.decode("utf-8") for v in values.tolist()]
+
+
+def read_manifest(artifact_dir=HOSPITAL_ARTIFACT_DIR):
+    try:
+        with open(os.path.join(artifact_dir, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def build_hospital_artifact(source=HOSPITAL_FILE, artifact_dir=HOSPITAL_ARTIFACT_DIR, checksum=None):
+    """
+    Writes the hospital directory as .npy arrays plus a manifest.json. Rows are sorted by
+    (state, city), keeping file order inside each city, so every block is a contiguous range.
+    """
+    checksum = checksum or file_checksum(source)
+    df = load_hospital_df(source).sort_values(["State", "City"], kind="stable").reset_index(drop=True)
+    blocks = df.groupby(["State", "City"], sort=False).indices
+    block_keys = list(blocks)
+    arrays = {
+        "names": encode(df["Hospital"]),
+        "addresses": encode(df["Norm_Address"]),
+        "cities": encode(df["City"]),
+        "states": encode(df["State"]),
+        "block_states": encode(state for state, _ in block_keys),
+        "block_cities": encode(city for _, city in block_keys),
+        "block_starts": np.array([blocks[key][0] for key in block_keys], dtype=np.int64),
+        "block_ends": np.array([blocks[key][-1] + 1 for key in block_keys], dtype=np.int64),
+    }
+
+    tmp_dir = f"{artifact_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": ARTIFACT_VERSION,
+            "source": os.path.basename(source),
+            "checksum": checksum,
+            "rows": len(df),
+            "blocks": len(block_keys),
+        }, f, indent=2)
+    # Swap the new build in with two renames and only then delete the old one, so a process
+    # opening the index meanwhile finds a complete artifact (or, for an instant, none at all)
+    old_dir = f"{artifact_dir}.old{os.getpid()}"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    try:
+        os.rename(artifact_dir, old_dir)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(tmp_dir, artifact_dir)
+    except OSError:
+        # Another process put the same build in place first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return checksum
+
+
+def open_hospital_index(source=HOSPITAL_FILE, artifact_dir=HOSPITAL_ARTIFACT_DIR, match_cache_path=MATCH_CACHE_FILE):
+    """
+    Loads the prebuilt hospital artifact, rebuilding it first if it is missing, from an older
+    version, or built from a different copy of the source file.
+    """
+    checksum = file_checksum(source)
+    manifest = read_manifest(artifact_dir)
+    if not manifest or manifest.get("version") != ARTIFACT_VERSION or manifest.get("checksum") != checksum:
+        build_hospital_artifact(source, artifact_dir, checksum)
+    return HospitalIndex.load(artifact_dir, HospitalMatchCache(path=match_cache_path, checksum=checksum))
+
+
+class HospitalIndex:
+    """
+    Hospitals blocked by (state, city). Each block holds the normalized street addresses and
+    hospital names in file order, so a lookup only scores the hospitals in the same city.
+    """
+
+    def __init__(self, names, addresses, block_ranges, cache=None):
+        self.names = names
+        self.addresses = addresses
+        self.block_ranges = block_ranges
+        self.cache = cache
+        self._blocks = {}
+
+    @classmethod
+    def from_df(cls, hospital_df, cache=None):
+        df = hospital_df.sort_values(["State", "City"], kind="stable").reset_index(drop=True)
+        block_ranges = {
+            key: (rows[0], rows[-1] + 1) for key, rows in df.groupby(["State", "City"], sort=False).indices.items()
+        }
+        return cls(encode(df["Hospital"]), encode(df["Norm_Address"]), block_ranges, cache)
+
+    @classmethod
+    def load(cls, artifact_dir=HOSPITAL_ARTIFACT_DIR, cache=None):
+        # Memory-mapped, so server processes on the same machine share the pages
+        arrays = {
+            name: np.load(os.path.join(artifact_dir, f"{name}.npy"), mmap_mode="r") for name in ARTIFACT_ARRAYS
+        }
+        block_ranges = {
+            (state, city): (int(start), int(end))
+            for state, city, start, end in zip(
+                decode(arrays["block_states"]), decode(arrays["block_cities"]),
+                arrays["block_starts"], arrays["block_ends"],
+            )
+        }
+        return cls(arrays["names"], arrays["addresses"], block_ranges, cache)
+
+    def _block(self, block_key):
+        """The (addresses, names) lists of one (state, city) block, or None if there is no such block."""
+        block = self._blocks.get(block_key)
+        if block is None:
+            block_range = self.block_ranges.get(block_key)
+            if block_range is None:
+                return None
+            start, end = block_range
+            block = (decode(self.addresses[start:end]), decode(self.names[start:end]))
+            self._blocks[block_key] = block
+        return block
+
+    def find(self, address, city, state, threshold=DEFAULT_THRESHOLD):
+        """
+        Name of the hospital whose street address best matches `address` (token sort ratio of
+        at least `threshold`) in the same city and state, or "" if none does. Ties go to the
+        hospital listed first.
+        """
+        key = (normalize_address(address), str(city).upper().strip(), str(state).upper().strip(), threshold)
+        if self.cache is not None:
+            hospital = self.cache.get(key)
+            if hospital is not None:
+                return hospital
+        hospital = self._score(*key)
+        if self.cache is not None:
+            self.cache.set(key, hospital)
+        return hospital
+
+    def find_many(self, lookups, threshold=DEFAULT_THRESHOLD):
+        """
+        find() for a list of (address, city, state) lookups. Cache misses are grouped by
+        (state, city) and each group is scored against its block in one multi-threaded
+        rapidfuzz cdist call. Returns the hospital names in the same order as lookups.
+        """
+        keys = [
+            (normalize_address(address), str(city).upper().strip(), str(state).upper().strip(), threshold)
+            for address, city, state in lookups
+        ]
+        found = {}
+        groups = {}
+        for key in dict.fromkeys(keys):
+            hospital = self.cache.get(key) if self.cache is not None else None
+            if hospital is not None:
+                found[key] = hospital
+            elif (key[2], key[1]) not in self.block_ranges:
+                found[key] = ""
+            else:
+                groups.setdefault((key[2], key[1]), []).append(key)
+        for block_key, group in groups.items():
+            addresses, names = self._block(block_key)
+            scores = process.cdist(
+                [key[0] for key in group], addresses,
+                scorer=fuzz.token_sort_ratio, score_cutoff=threshold, workers=-1,
+            )
+            for key, row in zip(group, scores):
+                best = int(row.argmax())  # argmax keeps the first of equal scores, like extractOne
+                found[key] = names[best] if row[best] >= threshold else ""
+        if self.cache is not None:
+            for block_key, group in groups.items():
+                for key in group:
+                    self.cache.set(key, found[key])
+        return [found[key] for key in keys]
+
+    def _score(self, norm_street, city, state, threshold):
+        block = self._block((state, city))
+        if block is None:
+            return ""
+        addresses, names = block
+        match = process.extractOne(norm_street, addresses, scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
+        return names[match[2]] if match else ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the prebuilt hospital directory artifact.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--source", default=HOSPITAL_FILE)
+    parser.add_argument("-o", "--output", default=HOSPITAL_ARTIFACT_DIR)
+    args = parser.parse_args(argv)
+    build_hospital_artifact(args.source, args.output)
+    manifest = read_manifest(args.output)
+    print(f"Wrote {manifest['rows']} hospitals in {manifest['blocks']} (state, city) blocks to {args.output}",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from sqlite_local import ThreadLocalConnection
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_CACHE_PATH = os.environ.get("NPI_CACHE_PATH", ".npi_cache.sqlite3")
+DEFAULT_TTL = 86400          # 24 hours for queries that returned providers
+DEFAULT_NEGATIVE_TTL = 3600  # 1 hour for zero-result queries
+DEFAULT_MAX_ENTRIES = 50000
+
+
+def norm(value):
+    """value as lowercase text with runs of whitespace collapsed; None is the empty string."""
+    return " ".join(str(value if value is not None else "").split()).lower()
+
+
+def make_cache_key(first, last, state, enumeration_type="NPI-1", version=2.1, max_results=500):
+    """
+    Builds the cache key for a registry query. Names are case- and whitespace-insensitive,
+    the same way the registry treats them.
+    """
+    return "|".join([
+        norm(first),
+        norm(last),
+        norm(state).upper(),
+        norm(enumeration_type).upper(),
+        str(version),
+        str(max_results),
+    ])
+
+
+class NPIResponseCache:
+    """
+    SQLite-backed cache for registry responses. Safe to share between threads of one
+    process and between processes (Streamlit servers, batch jobs) pointing at the same file.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._connect = ThreadLocalConnection(path)
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " payload BLOB NOT NULL,"
+                " result_count INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " expires REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def get(self, key):
+        """Returns the cached response dict, or None on a miss or an expired entry."""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT payload, result_count, expires FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        payload, result_count, expires = row
+        if expires <= now:
+            with conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            with self._lock:
+                self.misses += 1
+                self.expired += 1
+            return None
+        with conn:
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+            if result_count == 0:
+                self.negative_hits += 1
+        return json.loads(zlib.decompress(payload))
+
+    def set(self, key, response):
+        """Stores a response; zero-result responses get the shorter negative TTL."""
+        now = time.time()
+        result_count = response.get("result_count", 0)
+        ttl = self.ttl if result_count > 0 else self.negative_ttl
+        payload = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"))
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, payload, result_count, created, expires, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, payload, result_count, now, now + ttl, now),
+            )
+        with self._lock:
+            self._writes_since_evict += 1
+            # Checking the table size on every write is wasteful; do it in batches
+            should_evict = self._writes_since_evict >= max(1, self.max_entries // 100)
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones above max_entries."""
+        conn = self._connect()
+        with conn:
+            removed = conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),)).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                removed += conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
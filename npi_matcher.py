@@ -0,0 +1,1006 @@
+"""
+The NPI matching pipeline, usable without Streamlit. app.py drives it from the UI; the CLI runs
+it headless over a roster file:
+
+    python -m npi_matcher match roster.csv --states NY --strictness Good --limit 5 -o out.parquet
+"""
+import argparse
+import concurrent.futures
+import functools
+import logging
+import multiprocessing
+import re
+import sys
+import threading
+import time
+
+import pandas as pd
+from rapidfuzz import fuzz
+
+from npi_cache import NPIResponseCache, make_cache_key
+from npi_registry import (
+    AsyncRegistryEngine, DEFAULT_MAX_CONCURRENCY, REGISTRY_URL, RegistryError, filter_results_by_state,
+    is_complete_response, page_count,
+)
+from rate_limit import DEFAULT_MAX_RATE
+from nppes_local import NPPESIndex, DEFAULT_INDEX_PATH
+from hospitals import open_hospital_index
+from exports import write_excel
+from registry_cassette import DEFAULT_CASSETTE_PATH, open_cassette
+from run_metrics import RunMetrics, cache_delta
+
+logger = logging.getLogger(__name__)
+
+# -------------------- CONFIG & CONSTANTS --------------------
+REQUIRED_COLUMNS = {"First Name", "Last Name"}
+SPECIALTY_SCORE_CACHE_SIZE = 100000
+
+MATCH_STRATEGIES = [
+    ("Best: Full first and last name match", "Best"),
+    ("Good: Last name match + fuzzy first name", "Good"),
+    ("Potential: Last name only match", "Potential"),
+    ("Limited Potential: First name only match", "Limited Potential"),
+]
+
+STRICTNESS_LABELS = {match_level: label for label, match_level in MATCH_STRATEGIES}
+RESULT_COLUMNS = [
+    "Row_ID", "First_Name_Supplied", "Last_Name_Supplied", "FIRST_LAST", "Specialty_Supplied",
+    "Match_Level", "Result_Count", "Result", "NPI",
+    "First_Name", "Last_Name", "Middle_Name", "Creditials",
+    "Specialty_1", "Specialty_2",
+    "Address_1", "City_1", "State_1",
+    "Address_2", "City_2", "State_2",
+    "Address_3", "City_3", "State_3", "Matched Hospital", "Registry_Status"
+]
+
+US_STATES = [
+    "AK", "AL", "AR", "AZ", "CA", "CO", "CT", "DC", "DE", "FL", "GA", "HI", "IA", "ID", "IL", "IN", "KS", "KY",
+    "LA", "MA", "MD", "ME", "MI", "MN", "MO", "MS", "MT", "NC", "ND", "NE", "NH", "NJ", "NM", "NV", "NY", "OH",
+    "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VA", "VT", "WA", "WI", "WV", "WY"
+]
+
+# -------------------- ROSTER & RESULT HELPERS --------------------
+def validate_file(file, name=None):
+    name = name or file.name
+    try:
+        if name.endswith('.csv'):
+            df = pd.read_csv(file)
+        elif name.endswith(('.xls', '.xlsx')):
+            df = pd.read_excel(file)
+        else:
+            return None, "Unsupported file format. Please upload CSV."
+        # Standardize column names
+        df.columns = df.columns.str.strip()
+        rename_map = {
+            "First_Name": "First Name",
+            "Last_Name": "Last Name",
+            "Suffix": "Suffix",
+            "Specialty": "Specialty"
+        }
+        df = df.rename(columns=rename_map)
+        #if "Middle Name" not in df.columns:
+        df["Middle Name"] = ""
+        return df, None
+    except Exception as e:
+        return None, f"Error reading file: {str(e)}"
+
+def prepare_roster(df):
+    """
+    Fills the optional roster columns so every row can be matched, and numbers the rows
+    (Row_ID), so a provider's result rows stay together even if the roster repeats a name.
+    """
+    for column in ["First Name", "Last Name", "Middle Name", "Suffix", "Specialty"]:
+        if column not in df.columns:
+            df[column] = ""
+        df[column] = df[column].fillna("").astype(str)
+    df["Row_ID"] = range(len(df))
+    return df
+
+def load_roster(path):
+    df, error = validate_file(path, name=path)
+    if error:
+        raise ValueError(error)
+    missing = REQUIRED_COLUMNS - set(df.columns)
+    if missing:
+        raise ValueError(f"Roster is missing required column(s): {', '.join(sorted(missing))}")
+    return prepare_roster(df)
+
+def clean_specialty(s):
+    # Remove everything after a slash or comma (including the slash/comma)
+    if pd.isna(s):
+        return ""
+    return re.split(r"[/,]", str(s))[0].strip()
+
+def match_hospitals(result_rows, hospital_index):
+    """
+    Fills "Matched Hospital" for every result row from the first of its three addresses that
+    matches a hospital. All distinct addresses of the run are scored in one batch.
+    """
+    lookups = []
+    for result_row in result_rows:
+        for i in range(1, 4):
+            address = result_row.get(f"Address_{i}", "")
+            state_val = result_row.get(f"State_{i}", "")
+            if address and state_val:
+                lookups.append((address, result_row.get(f"City_{i}", ""), state_val))
+    hospitals = dict(zip(lookups, hospital_index.find_many(lookups)))
+    for result_row in result_rows:
+        matched_hospital = ""
+        for i in range(1, 4):
+            address = result_row.get(f"Address_{i}", "")
+            state_val = result_row.get(f"State_{i}", "")
+            if address and state_val:
+                hospital = hospitals[(address, result_row.get(f"City_{i}", ""), state_val)]
+                if hospital:
+                    matched_hospital = hospital
+                    break  # stop after first match
+        result_row["Matched Hospital"] = matched_hospital
+
+# -------------------- NPI API & MATCHING HELPERS --------------------
+class ProviderRecord:
+    """
+    The parts of one registry result that matching and the results table use, normalized once
+    when the response is fetched instead of for every candidate, strategy and retry.
+    """
+    __slots__ = (
+        "number", "first_name", "last_name", "middle_name", "credential",
+        "first_name_lower", "last_name_lower", "former_names",
+        "taxonomy_descs", "taxonomy_clean", "addresses", "states",
+    )
+
+    def __init__(self, result):
+        basic = result.get("basic", {})
+        self.number = result.get("number", "")
+        self.first_name = basic.get("first_name", "")
+        self.last_name = basic.get("last_name", "")
+        self.middle_name = basic.get("middle_name", "")
+        self.credential = basic.get("credential", "")
+        self.first_name_lower = (self.first_name or "").strip().lower()
+        self.last_name_lower = (self.last_name or "").strip().lower()
+        self.former_names = frozenset(
+            ((name.get("first_name", "") or "").strip().lower(), (name.get("last_name", "") or "").strip().lower())
+            for name in result.get("other_names") or []
+        )
+        taxonomies = result.get("taxonomies", [])
+        self.taxonomy_descs = tuple(t.get("desc", "") for t in taxonomies)
+        self.taxonomy_clean = tuple(clean_specialty(desc).lower() for desc in self.taxonomy_descs)
+        addresses = result.get("addresses", [])
+        self.addresses = tuple(
+            (a.get("address_1", ""), a.get("city", ""), a.get("state", "")) for a in addresses[:3]
+        )
+        self.states = frozenset((a.get("state") or "").upper() for a in addresses)
+
+class PagedCandidates:
+    """
+    The ProviderRecords of one registry query, loaded a page at a time as matching asks for
+    more. Every row issuing the query reads the same instance, so each page is fetched once.
+    """
+
+    def __init__(self, pages=None, response=None, on_page=None):
+        self.records = []
+        self.error = None
+        self.complete = False
+        self._pages = pages
+        self._on_page = on_page  # called with each page's load time
+        self._lock = threading.Lock()
+        if response is not None:
+            self.records = [ProviderRecord(r) for r in response.get("results", [])]
+            self.error = response.get("error")
+            self.complete = True
+
+    def _load_page(self, loaded):
+        """Loads the next page unless another thread already has; False once there are no more."""
+        with self._lock:
+            if len(self.records) > loaded:
+                return True
+            if self.complete:
+                return False
+            started = time.perf_counter()
+            try:
+                page = next(self._pages, None)
+            except RegistryError as e:
+                page, self.error = None, str(e)
+            if self._on_page is not None and (page is not None or self.error):
+                self._on_page(time.perf_counter() - started)
+            if page is None:
+                self.complete = True
+                self._pages = None
+                return False
+            self.records.extend(ProviderRecord(r) for r in page)
+            return True
+
+    def __iter__(self):
+        i = 0
+        while i < len(self.records) or self._load_page(i):
+            if i < len(self.records):
+                yield self.records[i]
+                i += 1
+
+    def response(self):
+        """The whole query as a {"results", "result_count"} response, loading any pages still missing."""
+        for _ in self:
+            pass
+        response = {"results": list(self.records), "result_count": len(self.records)}
+        if self.error:
+            response["error"] = self.error
+        return response
+
+class RegistryLookup:
+    """
+    Answers registry queries from the response cache, then either the registry engine or a
+    local NPPES index. query and query_many can be called from any thread, and stats() counts
+    where the answers came from. With a RegistryCassette, the engine records its pages to it or
+    replays them from it; close() saves it.
+    """
+
+    def __init__(self, engine=None, cache=None, local_index=None, cassette=None):
+        self.engine = engine
+        self.cache = cache
+        self.local_index = local_index
+        self.cassette = cassette
+        self._lock = threading.Lock()
+        self._counts = {"local_queries": 0, "cache_hits": 0, "registry_queries": 0, "registry_pages": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def get_cached_response(self, first, last, state, version=2.1, max_results=500):
+        """
+        Cache lookup for one query. A per-state query is also answered from a cached nationwide
+        query for the same name, as long as that nationwide result was not truncated.
+        """
+        if self.cache is None:
+            return None
+        cached = self.cache.get(make_cache_key(first, last, state, "NPI-1", version, max_results))
+        if cached is not None or not str(state).strip():
+            return cached
+        nationwide = self.cache.get(make_cache_key(first, last, "", "NPI-1", version, max_results))
+        if nationwide is not None and is_complete_response(nationwide, max_results):
+            results = filter_results_by_state(nationwide["results"], state)
+            return {"results": results, "result_count": len(results)}
+        return None
+
+    def query(self, first, last, state, version=2.1, max_results=500):
+        if self.local_index is not None:
+            self._count("local_queries")
+            return self.local_index.query(first, last, state, version, max_results)
+        cached = self.get_cached_response(first, last, state, version, max_results)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached
+
+        self._count("registry_queries")
+        response = self.engine.query(first, last, state, version, max_results, self.cassette)
+        self._count("registry_pages", page_count(response["result_count"], max_results))
+        if self.cache is not None and not response.get("error"):
+            # failed queries are retried next time, not cached
+            self.cache.set(make_cache_key(first, last, state, "NPI-1", version, max_results), response)
+        return response
+
+    def iter_pages(self, first, last, state, version=2.1, max_results=500):
+        """
+        query() a page at a time, fetching each page only when the caller asks for it. Cached
+        and local answers come back as one page, and a query read to the end is cached like
+        query() does. Raises RegistryError if a page fails for good.
+        """
+        if self.local_index is not None:
+            self._count("local_queries")
+            yield self.local_index.query(first, last, state, version, max_results)["results"]
+            return
+        cached = self.get_cached_response(first, last, state, version, max_results)
+        if cached is not None:
+            self._count("cache_hits")
+            yield cached["results"]
+            return
+        self._count("registry_queries")
+        results = []
+        for page in self.engine.iter_pages(first, last, state, version, max_results, self.cassette):
+            self._count("registry_pages")
+            results.extend(page)
+            yield page
+        if self.cache is not None:
+            self.cache.set(make_cache_key(first, last, state, "NPI-1", version, max_results),
+                           {"results": results, "result_count": len(results)})
+
+    def query_many(self, queries, version=2.1, max_results=500):
+        """
+        Same as query for a list of (first, last, state) queries. Cache misses are fetched
+        concurrently by the registry engine.
+        """
+        if self.local_index is not None:
+            self._count("local_queries", len(queries))
+            return self.local_index.query_many(queries, version, max_results)
+        responses = {}
+        missing = []
+        for query in queries:
+            cached = self.get_cached_response(*query, version, max_results)
+            if cached is not None:
+                responses[query] = cached
+            else:
+                missing.append(query)
+        self._count("cache_hits", len(queries) - len(missing))
+        self._count("registry_queries", len(missing))
+        for query, response in zip(missing, self.engine.query_many(missing, version, max_results, self.cassette)):
+            self._count("registry_pages", page_count(response["result_count"], max_results))
+            if self.cache is not None and not response.get("error"):
+                self.cache.set(make_cache_key(*query, "NPI-1", version, max_results), response)
+            responses[query] = response
+        return [responses[query] for query in queries]
+
+    def close(self):
+        if self.cassette is not None:
+            self.cassette.save()
+        if self.engine is not None:
+            self.engine.close()
+
+def use_nationwide_query(first, last, states):
+    """
+    Whether to answer a state search with one nationwide query split by address state. Only
+    full-name queries are: they return few records. A last-name or first-name only query for
+    a common name fills max_results nationwide, so its pages would all be fetched and then
+    thrown away for the per-state queries.
+    """
+    if states == [""]:
+        return False
+    return bool(str(first).strip() and str(last).strip())
+
+def state_queries(first, last, states):
+    """The registry queries fetch_for_states issues first for these states."""
+    if use_nationwide_query(first, last, states):
+        return [(first, last, "")]
+    return [(first, last, s) for s in states]
+
+def fetch_for_states(fetch, first, last, states, max_results=500):
+    """
+    ProviderRecords for each state in `states`, concatenated in that order, the same as
+    querying the states one by one. Uses a single nationwide query split locally by address
+    state when possible, and only falls back to per-state queries if that result was truncated.
+    """
+    if use_nationwide_query(first, last, states):
+        nationwide = fetch(first, last, "")
+        if nationwide.get("error"):
+            return []
+        if is_complete_response(nationwide, max_results):
+            return [r for s in states for r in nationwide["results"] if s.strip().upper() in r.states]
+    all_results = []
+    for s in states:
+        results_json = fetch(first, last, s)
+        all_results.extend(results_json.get('results', []) if results_json.get('result_count', 0) > 0 else [])
+    return all_results
+
+@functools.lru_cache(maxsize=SPECIALTY_SCORE_CACHE_SIZE)
+def best_specialty_score(specialty, taxonomy_descs):
+    """
+    Best token_sort_ratio of a supplied specialty against a provider's taxonomy descriptions.
+    Roster specialties and taxonomy combinations repeat constantly, so each distinct pair is
+    scored once and then looked up.
+    """
+    return max((fuzz.token_sort_ratio(specialty, desc) for desc in taxonomy_descs), default=0)
+
+def is_fuzzy_match(supplied, candidate, threshold=70):
+    return fuzz.partial_ratio(str(supplied).lower(), str(candidate).lower()) >= threshold
+
+class RowCandidates:
+    """
+    The candidate pools of one roster row for one set of states. Each distinct name query is
+    read once and shared by every strategy that needs it (Good and Potential both work over
+    the last-name pool). Pools are read lazily, so a strategy that stops early leaves the
+    remaining registry pages unfetched.
+    """
+
+    def __init__(self, pool, states, errors=None):
+        self.pool = pool
+        self.states = states
+        self.errors = errors
+        self._pools = {}
+
+    def _fetch(self, first, last, state):
+        # Every lookup goes through the run-wide candidate pool, so shared queries are fetched once
+        response = self.pool.get(first, last, state)
+        if response.get("error") and self.errors is not None:
+            self.errors.append(response["error"])
+        return response
+
+    def _load(self, first, last):
+        if len(self.states) == 1 and not use_nationwide_query(first, last, self.states):
+            paged = self.pool.get_paged(first, last, self.states[0])
+            yield from paged
+            if paged.error and self.errors is not None:
+                self.errors.append(paged.error)
+        else:
+            # Splitting a nationwide query by state needs all of it, to tell whether it was truncated
+            yield from fetch_for_states(self._fetch, first, last, self.states)
+
+    def iter(self, first, last):
+        """The pool's ProviderRecords in fetch_for_states order, loading more only as they are read."""
+        key = (first, last)
+        if key not in self._pools:
+            self._pools[key] = ([], self._load(first, last))
+        records, source = self._pools[key]
+        i = 0
+        while True:
+            if i == len(records):
+                record = next(source, None)
+                if record is None:
+                    return
+                records.append(record)
+            yield records[i]
+            i += 1
+
+def is_exact_name_match(m, first, last):
+    return (
+        (m.first_name_lower == first.strip().lower() and m.last_name_lower == last.strip().lower())
+        or matches_former_name(first, last, m.former_names)
+    )
+
+def best_strategy(row, candidates, specialty, limit):
+    """
+    Exact first + last (or former) name matches whose taxonomy contains the supplied specialty,
+    retrying with a trailing middle name split off the first name. Without a specialty match,
+    the name matches alone, closest specialty first.
+    """
+    first = row['First Name']
+    last = row['Last Name']
+    specialty_clean = clean_specialty(specialty).lower()
+
+    def has_specialty(m):
+        return (not specialty) or any(specialty_clean in desc for desc in m.taxonomy_clean)
+
+    def name_matches(first_val):
+        matches = []
+        top = set()
+        for m in candidates.iter(first_val, last):
+            if not is_exact_name_match(m, first_val, last):
+                continue
+            matches.append(m)
+            if "NY" in m.states and has_specialty(m):
+                top.add(m.number)
+                if len(top) >= limit:
+                    # Matches on later pages can only rank after these, so don't fetch them
+                    break
+        return matches
+
+    full_matches = name_matches(first)
+    with_specialty = [m for m in full_matches if has_specialty(m)]
+    if with_specialty:
+        return [("Best", m, True) for m in with_specialty]
+
+    split_matches = []
+    parts = str(first).strip().split()
+    if (row.get("Middle Name", "") == "") and len(parts) > 1:
+        split_matches = name_matches(" ".join(parts[:-1]))
+        with_specialty = [m for m in split_matches if has_specialty(m)]
+        if with_specialty:
+            return [("Best", m, True) for m in with_specialty]
+
+    # Prefer the full first name's matches, else the split name's
+    matches = sorted(
+        full_matches or split_matches,
+        key=lambda m: best_specialty_score(specialty, m.taxonomy_descs) if specialty else 0,
+        reverse=True,
+    )
+    return [("Best", m, False) for m in matches]
+
+def fuzzy_strategy(match_level, row, candidates, specialty, limit):
+    """
+    Good, Potential and Limited Potential: candidates from the last-name (or first-name) pool
+    that pass the strategy's name filter, ranked by the average of name and specialty score.
+    """
+    first = row['First Name']
+    last = row['Last Name']
+    fuzzy_threshold = 10
+    specialty_fuzzy_threshold = 80
+    # Nothing on a later page can outrank `limit` NY candidates that already have the top score
+    top_score = ((0 if match_level == "Potential" else 100) + (100 if specialty else 0)) / 2
+    top = set()
+
+    scored_matches = []
+    if match_level == "Limited Potential":
+        matches = candidates.iter(first, "")
+    else:
+        matches = candidates.iter("", last)
+    for m in matches:
+        if match_level == "Good":
+            if m.last_name_lower != last.strip().lower():
+                continue
+            name_score = fuzz.token_sort_ratio(first, m.first_name)
+            if name_score < fuzzy_threshold:
+                continue
+        elif match_level == "Limited Potential":
+            name_score = fuzz.token_sort_ratio(last, m.last_name)
+            if name_score < fuzzy_threshold:
+                continue
+        else:
+            name_score = 0
+        # Fuzzy score for specialty (max score among all taxonomies)
+        specialty_score = best_specialty_score(specialty, m.taxonomy_descs) if specialty else 0
+        specialty_matched = specialty_score >= specialty_fuzzy_threshold if specialty else False
+        score = (name_score + specialty_score) / 2
+        scored_matches.append((score, (match_level, m, specialty_matched)))
+        if score >= top_score and "NY" in m.states:
+            top.add(m.number)
+            if len(top) >= limit:
+                break
+
+    # Sort by average of name and specialty score, descending
+    scored_matches.sort(key=lambda x: x[0], reverse=True)
+    return [match for _, match in scored_matches]
+
+def match_provider(row, state, limit, search_type, pool, errors=None):
+    """
+    Runs the strategy cascade up to search_type for one row. Each strategy is a filter/rank pass
+    over the row's shared candidate pools, and the cascade stops at the first strategy with
+    matches: up to `limit` of them, NY providers first, plus the top match's specialty flag.
+    """
+    specialty = row.get('Specialty', "")
+
+    # Split state string into a list if needed
+    states = [s.strip() for s in state.split(",") if s.strip()] if state else [""]
+    candidates = RowCandidates(pool, states, errors)
+
+    selected_idx = [i for i, (label, _) in enumerate(MATCH_STRATEGIES) if label == search_type][0]
+
+    for label, match_level in MATCH_STRATEGIES[:selected_idx + 1]:
+        with pool.metrics.strategy(match_level):
+            if match_level == "Best":
+                ranked = best_strategy(row, candidates, specialty, limit)
+            else:
+                ranked = fuzzy_strategy(match_level, row, candidates, specialty, limit)
+
+            # The same NPI can come back once per state searched; keep its best-ranked entry
+            seen_npis = set()
+            all_matches = []
+            for match in ranked:
+                if match[1].number not in seen_npis:
+                    seen_npis.add(match[1].number)
+                    all_matches.append(match)
+            # --- NY prioritization: sort NY matches to the top before slicing to limit ---
+            all_matches = sorted(all_matches, key=lambda x: "NY" not in x[1].states)[:limit]
+        pool.metrics.count("strategy_passes", strategy=match_level, matched=bool(all_matches))
+        if all_matches:
+            return all_matches, all_matches[0][2]  # Return the specialty_matched of the top result
+
+    return [], False  # No matches found, specialty_matched is False
+
+def try_new_match(row, state, limit, search_type, pool, errors=None):
+    matches, specialty_matched = match_provider(row, state, limit, search_type, pool, errors)
+    if matches:
+        return matches, row, specialty_matched
+    return [], row, False
+
+def matches_former_name(first, last, former_names):
+    """
+    Checks if (first, last) matches any former name, with or without a middle name in 'first'.
+    former_names is a ProviderRecord's set of lowercased (first, last) pairs.
+    """
+    if not former_names:
+        return False
+    first = first.strip().lower()
+    last = last.strip().lower()
+    # Check as-is
+    if (first, last) in former_names:
+        return True
+    # If first name contains a space, try stripping the last part (middle name)
+    parts = first.split()
+    return len(parts) > 1 and (" ".join(parts[:-1]), last) in former_names
+
+def get_strategy_state_passes(user_states):
+    """
+    Returns a list of state groups for matching passes.
+    - If user_states is empty or contains NY, first pass is NY, second pass is all other states.
+    - If user_states is only NY, only NY is checked.
+    - If user_states does not contain NY, only those states are checked.
+    """
+    user_states = [s.strip() for s in user_states if s.strip()]
+    if not user_states:
+        # No filter: NY first, then all others
+        return [["NY"], [s for s in US_STATES if s != "NY"]]
+    elif user_states == ["NY"]:
+        # Only NY selected
+        return [["NY"]]
+    elif "NY" in user_states:
+        # NY in filter: NY first, then others in filter (excluding NY)
+        return [["NY"], [s for s in user_states if s != "NY"]]
+    else:
+        # NY not in filter: just use their filter
+        return [user_states]
+
+class CandidatePool:
+    """
+    Run-wide store of registry queries, with results kept as compact ProviderRecords. Each
+    distinct (first, last, state) query is read through one PagedCandidates, so its pages are
+    fetched at most once, and only as far as some row needed them. Also collects the run's
+    run metrics.
+    """
+
+    def __init__(self, lookup, metrics=None):
+        self.lookup = lookup
+        self.metrics = metrics or RunMetrics()
+        self._queries = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fetches = 0
+
+    def _observe_page(self, state, seconds):
+        self.metrics.observe(
+            "page_seconds", seconds, strategy=self.metrics.current_strategy or "other", state=state or "ALL"
+        )
+
+    def get_paged(self, first, last, state):
+        key = make_cache_key(first, last, state)
+        with self._lock:
+            self.requests += 1
+            paged = self._queries.get(key)
+            if paged is None:
+                # Nothing is fetched until the first record is read
+                paged = self._queries[key] = PagedCandidates(
+                    self.lookup.iter_pages(first, last, state),
+                    on_page=functools.partial(self._observe_page, str(state).strip().upper()),
+                )
+                self.fetches += 1
+        return paged
+
+    def get(self, first, last, state):
+        return self.get_paged(first, last, state).response()
+
+    def prefetch(self, queries, strategy=MATCH_STRATEGIES[0][1]):
+        """
+        Fetches planned queries concurrently, ahead of the rows that read them. They are the
+        first queries of `strategy` (the start of every cascade), and their queries and pages
+        are counted under it and their state.
+        """
+        with self._lock:
+            queries = [q for q in queries if make_cache_key(*q) not in self._queries]
+        with self.metrics.timer("prefetch_seconds"):
+            responses = self.lookup.query_many(queries)
+        for query, response in zip(queries, responses):
+            key = make_cache_key(*query)
+            with self._lock:
+                inserted = key not in self._queries  # a row may have fetched it meanwhile
+                if inserted:
+                    self._queries[key] = PagedCandidates(response=response)
+                    self.fetches += 1
+            if inserted:
+                labels = {"strategy": strategy, "state": str(query[2]).strip().upper() or "ALL"}
+                self.metrics.count("prefetched_queries", **labels)
+                self.metrics.count("prefetched_pages", page_count(response["result_count"]), **labels)
+
+def plan_registry_queries(df, state, search_type):
+    """
+    Walks the roster and the selected strategy cascade and returns the distinct registry
+    queries that every row issues first, in roster order. Fallback queries (middle-name split,
+    later state passes, looser strategies) depend on earlier results, so they are fetched on
+    demand through the same CandidatePool and are still only issued once per run.
+    """
+    user_states = state if isinstance(state, list) else [state]
+    if search_type == "Best: Full first and last name match":
+        first_pass_states = get_strategy_state_passes(user_states)[0]
+    else:
+        first_pass_states = [s.strip() for s in ",".join(user_states).split(",") if s.strip()] or [""]
+
+    planned = {}
+    for first, last in zip(df["First Name"], df["Last Name"]):
+        for query in state_queries(first, last, first_pass_states):
+            key = make_cache_key(*query)
+            if key not in planned:
+                planned[key] = query
+    return list(planned.values())
+
+# -------------------- ROW MATCHING --------------------
+def build_result_row(row_for_results, idx, match_level, m, specialty_matched, result_count):
+    """One row of the results table for the idx-th match (a ProviderRecord) of a roster row."""
+    result_row = {
+        "Row_ID": row_for_results.get("Row_ID", ""),
+        "First_Name_Supplied": row_for_results.get("First Name", ""),
+        "Last_Name_Supplied": row_for_results.get("Last Name", ""),
+        "FIRST_LAST": f"{row_for_results.get('First Name', '')} {row_for_results.get('Last Name', '')}".strip(),
+        #"Middle_Name_Supplied": row_for_results.get("Middle Name", ""),
+        "Specialty_Supplied": row_for_results.get("Specialty", ""),
+        "Match_Level": match_level,
+        "Specialty_Matched": specialty_matched,
+        "Result_Count": result_count,
+        "Result": f"{idx}",
+        "NPI": m.number,
+        "First_Name": m.first_name,
+        "Last_Name": m.last_name,
+        "Middle_Name": m.middle_name,
+        "Creditials": m.credential,
+        "Specialty_1": m.taxonomy_descs[0] if len(m.taxonomy_descs) > 0 else "",
+        "Specialty_2": m.taxonomy_descs[1] if len(m.taxonomy_descs) > 1 else "",
+    }
+    for i in range(3):
+        address_1, city, state = m.addresses[i] if len(m.addresses) > i else ("", "", "")
+        result_row[f"Address_{i + 1}"] = address_1
+        result_row[f"City_{i + 1}"] = city
+        result_row[f"State_{i + 1}"] = state
+    result_row["Suffix"] = row_for_results.get("Suffix", "")
+    return result_row
+
+def process_row(row, state, limit, search_type, pool):
+    """Matches one roster row and returns its result rows (a single "No Match" row if nothing matched)."""
+    logger.debug("process_row called for: %s", dict(row))
+    started = time.perf_counter()
+
+    result_rows = []
+    registry_errors = []  # failed registry queries for this row, reported instead of raised
+    found_match = False
+
+    if search_type == "Best: Full first and last name match":
+        # NY-first logic as before
+        state_passes = get_strategy_state_passes(state if isinstance(state, list) else [state])
+        for state_group in state_passes:
+            matches, row_for_results, specialty_matched = try_new_match(
+                row, ",".join(state_group), limit, search_type, pool, registry_errors
+            )
+            if matches:
+                found_match = True
+                for idx, (match_level, m, specialty_matched) in enumerate(matches, start=1):
+                    result_rows.append(build_result_row(row_for_results, idx, match_level, m, specialty_matched, len(matches)))
+                break  # Stop after first successful state group
+    else:
+        # For fuzzy strategies: search all selected states at once, then sort NY to top
+        states_to_use = state if isinstance(state, list) else [state]
+        matches, row_for_results, specialty_matched = try_new_match(
+            row, ",".join(states_to_use), limit*3, search_type, pool, registry_errors  # get more than limit to allow NY sorting
+        )
+        if matches:
+            # Sort NY matches to the top
+            def is_ny(m):
+                # m can be a tuple (match_level, record, specialty_matched) or just a record
+                match_obj = m[1] if isinstance(m, tuple) else m
+                return "NY" in match_obj.states
+            matches = sorted(matches, key=lambda m: not is_ny(m))
+            matches = matches[:limit]  # Apply limit after sorting NY to top
+
+            found_match = True
+            for idx, (match_level, m, specialty_matched) in enumerate(matches[:limit], start=1):
+                result_rows.append(build_result_row(row_for_results, idx, match_level, m, specialty_matched, len(matches)))
+
+    logger.debug("found_match: %s", found_match)
+    if not found_match:
+        result_rows.append({
+            "Row_ID": row.get("Row_ID", ""),
+            "First_Name_Supplied": row.get("First Name", ""),
+            "Last_Name_Supplied": row.get("Last Name", ""),
+            "FIRST_LAST": f"{row.get('First Name', '')} {row.get('Last Name', '')}".strip(),
+            "Specialty_Supplied": row.get("Specialty", ""),
+            "Match_Level": "No Match",
+            "Result_Count": 0,
+            "Result": "No Match",
+            "NPI": "",
+            "First_Name": "",
+            "Last_Name": "",
+            "Middle_Name": "",
+            "Creditials": "",
+            "Specialty_1": "",
+            "Specialty_2": "",
+            # Copy provider address fields here:
+            "Address_1": row.get("Address_1", ""),
+            "City_1": row.get("City_1", ""),
+            "State_1": row.get("State_1", ""),
+            "Address_2": row.get("Address_2", ""),
+            "City_2": row.get("City_2", ""),
+            "State_2": row.get("State_2", ""),
+            "Address_3": row.get("Address_3", ""),
+            "City_3": row.get("City_3", ""),
+            "State_3": row.get("State_3", ""),
+            "Specialty_Supplied": row.get("Specialty", ""),
+            "Suffix": row.get("Suffix", ""),
+            "Address Match": "",
+            "Matched Hospital": "",
+        })
+        # "Matched Hospital" is filled in for the whole run by match_hospitals
+    registry_status = "OK" if not registry_errors else "Error: " + "; ".join(sorted(set(registry_errors)))
+    for result_row in result_rows:
+        result_row["Registry_Status"] = registry_status
+    pool.metrics.observe("row_seconds", time.perf_counter() - started)
+    pool.metrics.count("rows", match_level=result_rows[0]["Match_Level"] if not registry_errors else "Error")
+    return result_rows
+
+
+# -------------------- HEADLESS PIPELINE --------------------
+def make_lookup(backend="api", index_path=DEFAULT_INDEX_PATH, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                max_rate=DEFAULT_MAX_RATE, use_cache=True, registry_url=REGISTRY_URL, cassette_mode="passthrough",
+                cassette_path=DEFAULT_CASSETTE_PATH):
+    if backend == "local":
+        return RegistryLookup(local_index=NPPESIndex(index_path))
+    cassette = open_cassette(cassette_mode, cassette_path)
+    return RegistryLookup(
+        engine=AsyncRegistryEngine(max_concurrency=max_concurrency, max_rate=max_rate, url=registry_url),
+        # A cassette stands in for the response cache: every page must go through it to be recorded or replayed
+        cache=NPIResponseCache() if use_cache and cassette is None else None,
+        cassette=cassette,
+    )
+
+def record_lookup_stats(metrics, before, after):
+    """Adds what a RegistryLookup answered between two stats() snapshots to the run's counters."""
+    for name, value in after.items():
+        if value != before[name]:
+            metrics.count(name, value - before[name])
+
+def record_cache_stats(metrics, hospital_index, hospital_before=None):
+    """Hospital match cache hits during the run, and the process-wide specialty score cache."""
+    if hospital_index.cache is not None and hospital_before is not None:
+        metrics.set("hospital_cache", cache_delta(hospital_before, hospital_index.cache.stats()))
+    metrics.set("specialty_score_cache", best_specialty_score.cache_info()._asdict())
+
+def match_rows(rows, state, limit, search_type, pool, max_workers):
+    """process_row over rows on a thread pool (the work is mostly waiting on the registry); results in row order."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda row: process_row(row, state, limit, search_type, pool), rows))
+
+_worker = {}
+
+def _init_worker(lookup_config):
+    # Each worker process has its own registry engine, connections and candidate pool;
+    # the SQLite response cache is shared with the parent through the file
+    _worker["pool"] = CandidatePool(make_lookup(**lookup_config))
+
+def _match_chunk(rows, state, limit, search_type, threads, prefetch=False):
+    # A worker runs one chunk at a time, so fresh metrics cover exactly this chunk
+    pool = _worker["pool"]
+    pool.metrics = RunMetrics()
+    lookup_before = pool.lookup.stats()
+    if prefetch:
+        pool.prefetch(plan_registry_queries(pd.DataFrame(rows), state, search_type))
+    row_results = match_rows(rows, state, limit, search_type, pool, threads)
+    record_lookup_stats(pool.metrics, lookup_before, pool.lookup.stats())
+    return row_results, pool.metrics.snapshot()
+
+def match_roster(df, state, limit, search_type, lookup_config, processes=1, threads=None, chunk_size=100,
+                 hospital_index=None, metrics=None):
+    """
+    Runs the whole pipeline over a prepared roster and returns the results as a DataFrame:
+    the first-pass registry queries are fetched concurrently, rows are matched on a thread pool
+    (in each of `processes` worker processes, which split the CPU-bound fuzzy scoring), and
+    practice addresses are matched to hospitals in one batch at the end. Pass a RunMetrics
+    to get the run's metrics.
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    threads = threads or max(8, lookup_config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    rows = [row for row in df.to_dict("records")]
+    lookup = make_lookup(**lookup_config)
+    lookup_before = lookup.stats()
+    try:
+        pool = CandidatePool(lookup, metrics)
+        # Worker processes only see what the parent fetched through the shared SQLite cache;
+        # without it, each worker prefetches its own chunks instead of fetching everything twice
+        prefetch_in_workers = processes > 1 and lookup.cache is None
+        if not prefetch_in_workers:
+            planned_queries = plan_registry_queries(df, state, search_type)
+            logger.info("Fetching %d distinct registry queries for %d rows", len(planned_queries), len(rows))
+            pool.prefetch(planned_queries)
+        if processes <= 1:
+            metrics.set("row_workers", threads)
+            row_results = match_rows(rows, state, limit, search_type, pool, threads)
+    finally:
+        record_lookup_stats(metrics, lookup_before, lookup.stats())
+        if lookup.cassette is not None:
+            metrics.set("registry_cassette", lookup.cassette.stats())
+        lookup.close()
+
+    if processes > 1:
+        # Workers share the registry budget instead of each getting the full one
+        worker_config = dict(lookup_config)
+        for key in ("max_concurrency", "max_rate"):
+            if key in worker_config:
+                worker_config[key] = max(1, worker_config[key] / processes)
+        worker_config["max_concurrency"] = int(worker_config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+        metrics.set("row_workers", processes * max(2, threads // processes))
+        # spawn, not fork: the parent already runs the registry engine's event loop thread
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(worker_config,),
+        ) as executor:
+            futures = [
+                executor.submit(_match_chunk, chunk, state, limit, search_type, max(2, threads // processes),
+                                prefetch_in_workers)
+                for chunk in chunks
+            ]
+            row_results = []
+            for done, future in enumerate(futures, start=1):
+                chunk_results, chunk_metrics = future.result()
+                row_results.extend(chunk_results)
+                metrics.merge(chunk_metrics)
+                logger.info("Matched %d / %d rows", min(done * chunk_size, len(rows)), len(rows))
+
+    result_rows = [result_row for result_rows in row_results for result_row in result_rows]
+    hospital_index = hospital_index or open_hospital_index()
+    hospital_before = hospital_index.cache.stats() if hospital_index.cache is not None else None
+    try:
+        with metrics.timer("hospital_seconds"):
+            match_hospitals(result_rows, hospital_index)
+    finally:
+        if hospital_index.cache is not None:
+            hospital_index.cache.save()  # keep resolved addresses for the next run
+    record_cache_stats(metrics, hospital_index, hospital_before)
+    metrics.finish()
+    for entry in metrics.snapshot()["histograms"].get("strategy_seconds", []):
+        logger.info("%s: %d passes, %.2fs", entry["labels"]["strategy"], entry["count"], entry["sum"])
+    return pd.DataFrame(result_rows, columns=RESULT_COLUMNS)
+
+def write_results(result_df, path):
+    if path.endswith(".parquet"):
+        result_df.to_parquet(path, index=False)
+    elif path.endswith(".xlsx"):
+        write_excel(result_df, path)
+    elif path.endswith(".xls"):
+        # Only .xlsx can be written, and xlsx bytes under an .xls name do not open as .xls
+        raise ValueError(f"Cannot write the legacy .xls format; use {path}x instead")
+    else:
+        result_df.to_csv(path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="npi_matcher", description="Match a provider roster to NPI records.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    match = subparsers.add_parser("match", help="Match every row of a roster file")
+    match.add_argument("roster", help="CSV or Excel roster with First Name / Last Name (and optional Specialty)")
+    match.add_argument("-o", "--output", required=True, help="Results file (.csv, .csv.gz, .xlsx or .parquet)")
+    match.add_argument("--states", nargs="*", default=[], metavar="STATE",
+                       help="Limit the search to these states (space or comma separated)")
+    match.add_argument("--strictness", choices=list(STRICTNESS_LABELS), default="Best")
+    match.add_argument("--limit", type=int, default=5, help="Max matches per provider")
+    match.add_argument("--backend", choices=["api", "local"], default="api",
+                       help="NPI Registry API, or a local NPPES index built with nppes_local.py")
+    match.add_argument("--index", default=DEFAULT_INDEX_PATH, help="NPPES index file for --backend local")
+    match.add_argument("--processes", type=int, default=1,
+                       help="Worker processes for matching; each runs its own thread pool")
+    match.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    match.add_argument("--max-rate", type=float, default=DEFAULT_MAX_RATE)
+    match.add_argument("--no-cache", action="store_true", help="Do not read or write the registry response cache")
+    match.add_argument("--metrics", metavar="PATH", help="Also write the run's metrics to this JSON file")
+    cassette = match.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETTE",
+                          help="Record every registry page of the run to this archive (.json.gz)")
+    cassette.add_argument("--replay", metavar="CASSETTE",
+                          help="Serve every registry page from a recorded archive, with no network")
+    match.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s", stream=sys.stderr)
+    states = [s.strip().upper() for value in args.states for s in value.split(",") if s.strip()]
+    unknown = [s for s in states if s not in US_STATES]
+    if unknown:
+        parser.error(f"unknown state(s): {', '.join(unknown)}")
+    if (args.record or args.replay) and args.backend != "api":
+        parser.error("--record and --replay only apply to --backend api")
+    if args.output.endswith(".xls"):
+        parser.error(f"cannot write the legacy .xls format; use {args.output}x")
+    if args.record and args.processes > 1:
+        # Worker processes would each write their own copy of the archive
+        parser.error("--record needs --processes 1")
+
+    df = load_roster(args.roster)
+    lookup_config = {
+        "backend": args.backend,
+        "index_path": args.index,
+        "max_concurrency": args.max_concurrency,
+        "max_rate": args.max_rate,
+        "use_cache": not args.no_cache,
+        "cassette_mode": "record" if args.record else "replay" if args.replay else "passthrough",
+        "cassette_path": args.record or args.replay or DEFAULT_CASSETTE_PATH,
+    }
+    metrics = RunMetrics()
+    result_df = match_roster(
+        df, states, args.limit, STRICTNESS_LABELS[args.strictness], lookup_config, processes=args.processes,
+        metrics=metrics,
+    )
+    write_results(result_df, args.output)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(metrics.to_json())
+    print(f"Matched {len(df)} rows into {len(result_df)} result rows: {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import AIMDController, DEFAULT_MAX_RATE
+
+# -------------------- CONFIG & CONSTANTS --------------------
+REGISTRY_URL = os.environ.get("NPI_REGISTRY_URL", "https://npiregistry.cms.hhs.gov/api/")
+REGISTRY_PAGE_LIMIT = 200   # the registry never returns more than 200 records per request
+REGISTRY_MAX_SKIP = 1000    # ...and rejects skip values above 1000
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RegistryError(Exception):
+    """A registry request that failed for good (after retries, or with a non-retryable error)."""
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=30.0):
+    """
+    Exponential backoff with full jitter. A numeric Retry-After header from the registry
+    is honored as a lower bound.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+def parse_page(status, data):
+    """
+    Turns one registry response into its list of results. Raises RegistryError for
+    responses that should not be retried and returns None for ones that should.
+    """
+    if status in RETRY_STATUSES:
+        return None
+    if status >= 400:
+        raise RegistryError(f"HTTP {status}")
+    if data is None:
+        return None  # body was not JSON (e.g. a gateway error page)
+    if data.get("Errors"):
+        messages = "; ".join(
+            str(e.get("description", e)) if isinstance(e, dict) else str(e) for e in data["Errors"]
+        )
+        raise RegistryError(f"Registry rejected query: {messages}")
+    return data.get("results", []) or []
+
+
+def error_response(error, results=()):
+    results = list(results)
+    return {"results": results, "result_count": len(results), "error": str(error)}
+
+
+def build_params(first, last, state, version=2.1, limit=REGISTRY_PAGE_LIMIT, skip=0):
+    return {
+        "first_name": first,
+        "last_name": last,
+        "state": state,
+        "limit": limit,
+        "skip": skip,
+        "version": version,
+        "enumeration_type": "NPI-1",
+    }
+
+
+def address_states(record):
+    return {(a.get("state") or "").upper() for a in record.get("addresses", [])}
+
+
+def is_complete_response(response, max_results=500):
+    """True when a response holds every match, i.e. it was not cut off at max_results or by an error."""
+    return not response.get("error") and response.get("result_count", 0) < max_results
+
+
+def filter_results_by_state(results, state):
+    """The subset of a nationwide result list the registry would return for `state`, in the same order."""
+    state = state.strip().upper()
+    return [r for r in results if state in address_states(r)]
+
+
+def page_plan(max_results, page_limit=REGISTRY_PAGE_LIMIT):
+    """Returns the (skip, limit) of every page needed to collect up to max_results records."""
+    pages = []
+    skip = 0
+    while skip < max_results and skip <= REGISTRY_MAX_SKIP:
+        pages.append((skip, min(page_limit, max_results - skip)))
+        skip += page_limit
+    return pages
+
+
+def page_count(result_count, max_results=500, page_limit=REGISTRY_PAGE_LIMIT):
+    """How many pages AsyncRegistryEngine.query_async requests for a result of result_count records."""
+    pages = page_plan(max_results, page_limit)
+    # The first page, then every remaining page at once if the first one came back full
+    return len(pages) if result_count >= pages[0][1] else 1
+
+
+class AdaptiveGate:
+    """asyncio gate whose capacity follows the controller's current concurrency."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.controller.concurrency)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class AsyncRegistryEngine:
+    """
+    Fetches registry queries on a background asyncio loop. An AIMD controller decides how
+    many requests may be in flight (up to max_concurrency) and paces them through a shared
+    token bucket (up to max_rate per second). Pages after the first are requested together
+    instead of one by one.
+
+    The synchronous methods (query, query_many) can be called from any thread, so the row
+    workers of a matching run all share one connection pool and one concurrency cap.
+
+    Every query method takes an optional RegistryCassette: pages are then recorded to it
+    ("record") or served from it without touching the network ("replay"). It is passed per
+    call rather than kept on the engine, so runs sharing one engine can each use their own.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_rate=DEFAULT_MAX_RATE, url=REGISTRY_URL,
+                 timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.controller = AIMDController(max_concurrency, max_rate)
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._gate = None
+        self._start_lock = threading.Lock()
+
+    # -------------------- EVENT LOOP --------------------
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="npi-registry-loop", daemon=True)
+            thread.start()
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            self._loop, self._thread = loop, thread
+
+    async def _open(self):
+        # The gate and session must be created on the loop that uses them
+        self._gate = AdaptiveGate(self.controller)
+        # No connection cap of its own: the gate already bounds requests in flight, and its bound
+        # can be raised after the pool exists (set_limits). Idle connections are kept alive for reuse.
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60, ttl_dns_cache=300),
+        )
+
+    def set_limits(self, max_concurrency, max_rate):
+        """Changes the engine's concurrency and rate ceilings, e.g. from a settings change."""
+        self.max_concurrency = max_concurrency
+        self.controller.set_limits(max_concurrency, max_rate)
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = self._thread = self._session = self._gate = None
+
+    def _run(self, coro):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    # -------------------- ASYNC API --------------------
+    async def fetch_page(self, params, cassette=None):
+        """Fetches one page, retrying 429/5xx, timeouts and non-JSON bodies with backoff."""
+        if cassette is not None and cassette.mode == "replay":
+            return cassette.replay(params)
+        results = await self._fetch_page(params)
+        if cassette is not None:
+            cassette.record(params, results)
+        return results
+
+    async def _fetch_page(self, params):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._gate:
+                await asyncio.sleep(self.controller.bucket.reserve())
+                started = time.monotonic()
+                try:
+                    async with self._session.get(self.url, params=params) as r:
+                        retry_after = r.headers.get("Retry-After")
+                        try:
+                            data = await r.json(content_type=None)
+                        except ValueError:
+                            data = None
+                    # A non-JSON error body still carries its status (e.g. a plain-text 429)
+                    self.controller.record(time.monotonic() - started,
+                                           r.status if data is not None or r.status >= 400 else None)
+                    results = parse_page(r.status, data)
+                    if results is not None:
+                        return results
+                    error = f"HTTP {r.status}" if r.status >= 400 else "invalid JSON response"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.controller.record(time.monotonic() - started, None)
+                    error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            if attempt < self.max_retries:
+                # Sleep outside the gate so waiting retries don't hold a request slot
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+        raise RegistryError(f"{error} after {self.max_retries + 1} attempts")
+
+    async def query_async(self, first, last, state, version=2.1, max_results=500, cassette=None):
+        """
+        Returns {"results", "result_count"}; failed queries come back with an "error" message
+        (and whatever pages did load) instead of raising.
+        """
+        pages = page_plan(max_results)
+        first_skip, first_limit = pages[0]
+        try:
+            results = await self.fetch_page(build_params(first, last, state, version, first_limit, first_skip), cassette)
+        except RegistryError as e:
+            return error_response(e)
+        if len(results) == first_limit and len(pages) > 1:
+            # The first page was full, so request every remaining page at once
+            rest = await asyncio.gather(*[
+                self.fetch_page(build_params(first, last, state, version, page_limit, skip), cassette)
+                for skip, page_limit in pages[1:]
+            ], return_exceptions=True)
+            for (_, page_limit), page in zip(pages[1:], rest):
+                if isinstance(page, Exception):
+                    if not isinstance(page, RegistryError):
+                        raise page
+                    return error_response(page, results[:max_results])
+                results.extend(page)
+                if len(page) < page_limit:
+                    break
+        results = results[:max_results]
+        return {"results": results, "result_count": len(results)}
+
+    async def query_many_async(self, queries, version=2.1, max_results=500, cassette=None):
+        return await asyncio.gather(*[
+            self.query_async(first, last, state, version, max_results, cassette) for first, last, state in queries
+        ])
+
+    # -------------------- SYNC FACADE --------------------
+    def query(self, first, last, state, version=2.1, max_results=500, cassette=None):
+        return self._run(self.query_async(first, last, state, version, max_results, cassette))
+
+    def iter_pages(self, first, last, state, version=2.1, max_results=500, cassette=None):
+        """
+        Lazily yields the result pages of one query. Each page is only requested when the caller
+        asks for it, so a caller that has seen enough never fetches the rest. Raises RegistryError
+        if a page fails for good.
+        """
+        for skip, page_limit in page_plan(max_results):
+            page = self._run(self.fetch_page(build_params(first, last, state, version, page_limit, skip), cassette))
+            yield page
+            if len(page) < page_limit:
+                return
+
+    def query_many(self, queries, version=2.1, max_results=500, cassette=None):
+        """Runs a list of (first, last, state) queries concurrently; responses come back in order."""
+        return self._run(self.query_many_async(list(queries), version, max_results, cassette))
+
+
+class RegistryClient:
+    """
+    Blocking registry client for scripts and notebooks. Each thread gets its own keep-alive
+    session, so worker threads never share a requests.Session. Requests are paced by the
+    controller's token bucket, which can be shared with an AsyncRegistryEngine.
+    """
+
+    def __init__(self, url=REGISTRY_URL, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 controller=None, cassette=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.controller = controller or AIMDController(DEFAULT_MAX_CONCURRENCY)
+        self.cassette = cassette
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return session
+
+    def fetch_page(self, params):
+        """Same retry policy (and cassette handling) as AsyncRegistryEngine.fetch_page."""
+        if self.cassette is not None and self.cassette.mode == "replay":
+            return self.cassette.replay(params)
+        results = self._fetch_page(params)
+        if self.cassette is not None:
+            self.cassette.record(params, results)
+        return results
+
+    def _fetch_page(self, params):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            time.sleep(self.controller.bucket.reserve())
+            started = time.monotonic()
+            try:
+                r = self._session().get(self.url, params=params, timeout=self.timeout)
+                retry_after = r.headers.get("Retry-After")
+                try:
+                    data = r.json()
+                except ValueError:
+                    data = None
+                self.controller.record(time.monotonic() - started,
+                                       r.status_code if data is not None or r.status_code >= 400 else None)
+                results = parse_page(r.status_code, data)
+                if results is not None:
+                    return results
+                error = f"HTTP {r.status_code}" if r.status_code >= 400 else "invalid JSON response"
+            except requests.RequestException as e:
+                self.controller.record(time.monotonic() - started, None)
+                error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt, retry_after))
+        raise RegistryError(f"{error} after {self.max_retries + 1} attempts")
+
+    def search(self, params):
+        """One registry request with arbitrary parameters; errors are returned, not raised."""
+        try:
+            results = self.fetch_page(params)
+        except RegistryError as e:
+            return error_response(e)
+        return {"results": results, "result_count": len(results)}
+
+    def iter_pages(self, first, last, state, version=2.1, max_results=500):
+        """Same as AsyncRegistryEngine.iter_pages."""
+        for skip, page_limit in page_plan(max_results):
+            page = self.fetch_page(build_params(first, last, state, version, page_limit, skip))
+            yield page
+            if len(page) < page_limit:
+                return
+
+    def query(self, first, last, state, version=2.1, max_results=500):
+        results = []
+        try:
+            for page in self.iter_pages(first, last, state, version, max_results):
+                results.extend(page)
+        except RegistryError as e:
+            return error_response(e, results)
+        return {"results": results, "result_count": len(results)}
@@ -0,0 +1,282 @@
+"""
+Local NPPES backend: ingests the NPPES bulk dissemination file (npidata_pfile_*.csv, or any
+file with the same columns) into an indexed SQLite store and answers the same queries as the
+NPI Registry API, returning records in the registry's JSON shape.
+
+    python nppes_local.py build npidata_pfile.csv --taxonomy nucc_taxonomy.csv -o nppes.sqlite3
+    python nppes_local.py query nppes.sqlite3 --first Leena --last Abdelrahman --state NY
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import zlib
+
+from npi_cache import norm
+from sqlite_local import ThreadLocalConnection
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_INDEX_PATH = os.environ.get("NPPES_DB_PATH", "nppes.sqlite3")
+MAX_TAXONOMIES = 15
+BATCH_SIZE = 10000
+
+# NPPES column names
+COL_NPI = "NPI"
+COL_ENTITY_TYPE = "Entity Type Code"
+COL_LAST = "Provider Last Name (Legal Name)"
+COL_FIRST = "Provider First Name"
+COL_MIDDLE = "Provider Middle Name"
+COL_PREFIX = "Provider Name Prefix Text"
+COL_SUFFIX = "Provider Name Suffix Text"
+COL_CREDENTIAL = "Provider Credential Text"
+COL_OTHER_LAST = "Provider Other Last Name"
+COL_OTHER_FIRST = "Provider Other First Name"
+COL_OTHER_MIDDLE = "Provider Other Middle Name"
+COL_OTHER_TYPE = "Provider Other Last Name Type Code"
+COL_DEACTIVATION = "NPI Deactivation Date"
+COL_REACTIVATION = "NPI Reactivation Date"
+ADDRESS_COLUMNS = {
+    # Practice location first, like the registry API
+    "LOCATION": (
+        "Provider First Line Business Practice Location Address",
+        "Provider Second Line Business Practice Location Address",
+        "Provider Business Practice Location Address City Name",
+        "Provider Business Practice Location Address State Name",
+        "Provider Business Practice Location Address Postal Code",
+        "Provider Business Practice Location Address Telephone Number",
+    ),
+    "MAILING": (
+        "Provider First Line Business Mailing Address",
+        "Provider Second Line Business Mailing Address",
+        "Provider Business Mailing Address City Name",
+        "Provider Business Mailing Address State Name",
+        "Provider Business Mailing Address Postal Code",
+        "Provider Business Mailing Address Telephone Number",
+    ),
+}
+
+
+def load_taxonomy_descriptions(path):
+    """
+    Reads the NUCC taxonomy code set CSV into {code: desc}, with desc formatted the way the
+    registry API shows it ("Classification, Specialization").
+    """
+    descriptions = {}
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as f:
+        for row in csv.DictReader(f):
+            code = (row.get("Code") or "").strip()
+            classification = (row.get("Classification") or "").strip()
+            specialization = (row.get("Specialization") or "").strip()
+            if code:
+                descriptions[code] = f"{classification}, {specialization}" if specialization else classification
+    return descriptions
+
+
+def row_to_record(row, taxonomy_descriptions):
+    """Converts one NPPES row into a registry-style result dict."""
+    taxonomies = []
+    for i in range(1, MAX_TAXONOMIES + 1):
+        code = (row.get(f"Healthcare Provider Taxonomy Code_{i}") or "").strip()
+        if not code:
+            continue
+        taxonomies.append({
+            "code": code,
+            "desc": taxonomy_descriptions.get(code, code),
+            "primary": (row.get(f"Healthcare Provider Primary Taxonomy Switch_{i}") or "").strip() == "Y",
+            "state": (row.get(f"Provider License Number State Code_{i}") or "").strip(),
+            "license": (row.get(f"Provider License Number_{i}") or "").strip(),
+        })
+    addresses = []
+    for purpose, (line1, line2, city, state, postal_code, phone) in ADDRESS_COLUMNS.items():
+        if not (row.get(line1) or row.get(city)):
+            continue
+        addresses.append({
+            "address_purpose": purpose,
+            "address_1": (row.get(line1) or "").strip(),
+            "address_2": (row.get(line2) or "").strip(),
+            "city": (row.get(city) or "").strip(),
+            "state": (row.get(state) or "").strip().upper(),
+            "postal_code": (row.get(postal_code) or "").strip(),
+            "telephone_number": (row.get(phone) or "").strip(),
+        })
+    other_names = []
+    if (row.get(COL_OTHER_LAST) or "").strip() or (row.get(COL_OTHER_FIRST) or "").strip():
+        other_names.append({
+            "type": (row.get(COL_OTHER_TYPE) or "").strip(),
+            "first_name": (row.get(COL_OTHER_FIRST) or "").strip(),
+            "last_name": (row.get(COL_OTHER_LAST) or "").strip(),
+            "middle_name": (row.get(COL_OTHER_MIDDLE) or "").strip(),
+        })
+    return {
+        "number": (row.get(COL_NPI) or "").strip(),
+        "enumeration_type": "NPI-1",
+        "basic": {
+            "first_name": (row.get(COL_FIRST) or "").strip(),
+            "last_name": (row.get(COL_LAST) or "").strip(),
+            "middle_name": (row.get(COL_MIDDLE) or "").strip(),
+            "credential": (row.get(COL_CREDENTIAL) or "").strip(),
+            "name_prefix": (row.get(COL_PREFIX) or "").strip(),
+            "name_suffix": (row.get(COL_SUFFIX) or "").strip(),
+        },
+        "taxonomies": taxonomies,
+        "addresses": addresses,
+        "other_names": other_names,
+    }
+
+
+def is_active_individual(row):
+    if (row.get(COL_ENTITY_TYPE) or "").strip() != "1":
+        return False
+    # Deactivated NPIs only come back if they were reactivated later
+    return not (row.get(COL_DEACTIVATION) or "").strip() or bool((row.get(COL_REACTIVATION) or "").strip())
+
+
+def build_index(csv_path, index_path=DEFAULT_INDEX_PATH, taxonomy_path=None, progress=None):
+    """
+    Streams an NPPES CSV into a fresh SQLite index at index_path. Only active individual
+    (NPI-1) providers are kept. Returns the number of providers indexed.
+
+    The NPPES file only has taxonomy codes, so the NUCC code set at taxonomy_path is required:
+    without descriptions, specialty matching would score every provider near zero.
+    """
+    if not taxonomy_path:
+        raise ValueError("A NUCC taxonomy CSV is required to build an NPPES index (taxonomy_path)")
+    taxonomy_descriptions = load_taxonomy_descriptions(taxonomy_path)
+    if not taxonomy_descriptions:
+        raise ValueError(f"No taxonomy codes found in {taxonomy_path}")
+    tmp_path = index_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        "CREATE TABLE providers ("
+        " npi TEXT PRIMARY KEY,"
+        " first_name TEXT NOT NULL,"
+        " last_name TEXT NOT NULL,"
+        " other_first_name TEXT NOT NULL,"
+        " other_last_name TEXT NOT NULL,"
+        " record BLOB NOT NULL)"
+    )
+    # Keyed on (state, npi): a provider listed more than once in the file is still found once per state
+    conn.execute(
+        "CREATE TABLE provider_states (state TEXT NOT NULL, npi TEXT NOT NULL, PRIMARY KEY (state, npi)) WITHOUT ROWID"
+    )
+
+    count = 0
+    providers, states = [], []
+    with open(csv_path, newline="", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            if not is_active_individual(row):
+                continue
+            record = row_to_record(row, taxonomy_descriptions)
+            other = record["other_names"][0] if record["other_names"] else {}
+            providers.append((
+                record["number"],
+                norm(record["basic"]["first_name"]),
+                norm(record["basic"]["last_name"]),
+                norm(other.get("first_name")),
+                norm(other.get("last_name")),
+                zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8")),
+            ))
+            # Each of the provider's states once, in address order
+            for state in dict.fromkeys(a["state"] for a in record["addresses"] if a["state"]):
+                states.append((state, record["number"]))
+            count += 1
+            if len(providers) >= BATCH_SIZE:
+                conn.executemany("INSERT OR REPLACE INTO providers VALUES (?, ?, ?, ?, ?, ?)", providers)
+                conn.executemany("INSERT OR IGNORE INTO provider_states VALUES (?, ?)", states)
+                providers, states = [], []
+                if progress:
+                    progress(count)
+    conn.executemany("INSERT OR REPLACE INTO providers VALUES (?, ?, ?, ?, ?, ?)", providers)
+    conn.executemany("INSERT OR IGNORE INTO provider_states VALUES (?, ?)", states)
+
+    # Indexes are much cheaper to build once the table is loaded
+    conn.execute("CREATE INDEX providers_last_first ON providers (last_name, first_name)")
+    conn.execute("CREATE INDEX providers_first ON providers (first_name)")
+    conn.execute("CREATE INDEX providers_other_last_first ON providers (other_last_name, other_first_name)")
+    conn.execute("CREATE INDEX providers_other_first ON providers (other_first_name)")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, index_path)
+    return count
+
+
+class NPPESIndex:
+    """
+    Read-only view of an index built by build_index. query() takes the same arguments as
+    the registry engine and returns the same {"results", "result_count"} shape.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"NPPES index not found: {path}")
+        self.path = path
+        self._connect = ThreadLocalConnection(path, read_only=True)
+
+    def query(self, first, last, state, version=2.1, max_results=500):
+        first, last, state = norm(first), norm(last), str(state or "").strip().upper()
+        if not first and not last:
+            return {"results": [], "result_count": 0}
+        # Match the legal name or the other (former) name, like the registry does
+        conditions, params = [], []
+        if first and last:
+            conditions.append("((p.first_name = ? AND p.last_name = ?) OR (p.other_first_name = ? AND p.other_last_name = ?))")
+            params += [first, last, first, last]
+        elif last:
+            conditions.append("(p.last_name = ? OR p.other_last_name = ?)")
+            params += [last, last]
+        else:
+            conditions.append("(p.first_name = ? OR p.other_first_name = ?)")
+            params += [first, first]
+        sql = "SELECT p.record FROM providers p"
+        if state:
+            sql += " JOIN provider_states s ON s.npi = p.npi AND s.state = ?"
+            params.insert(0, state)
+        sql += " WHERE " + " AND ".join(conditions) + " ORDER BY p.npi LIMIT ?"
+        params.append(max_results)
+        results = [json.loads(zlib.decompress(blob)) for (blob,) in self._connect().execute(sql, params)]
+        return {"results": results, "result_count": len(results)}
+
+    def query_many(self, queries, version=2.1, max_results=500):
+        return [self.query(first, last, state, version, max_results) for first, last, state in queries]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM providers").fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query a local NPPES index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Ingest an NPPES CSV into a SQLite index")
+    build.add_argument("csv_path")
+    build.add_argument("-o", "--output", default=DEFAULT_INDEX_PATH)
+    build.add_argument("--taxonomy", required=True,
+                       help="NUCC taxonomy CSV (nucc_taxonomy_*.csv), used to fill in taxonomy descriptions")
+
+    query = subparsers.add_parser("query", help="Look up providers in an index")
+    query.add_argument("index_path")
+    query.add_argument("--first", default="")
+    query.add_argument("--last", default="")
+    query.add_argument("--state", default="")
+    query.add_argument("--max-results", type=int, default=500)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        count = build_index(
+            args.csv_path, args.output, args.taxonomy,
+            progress=lambda n: print(f"{n} providers indexed...", file=sys.stderr),
+        )
+        print(f"Indexed {count} providers into {args.output}")
+    else:
+        response = NPPESIndex(args.index_path).query(args.first, args.last, args.state, max_results=args.max_results)
+        print(json.dumps(response, indent=2))
+
+
+if __name__ == "__main__":
+    main()
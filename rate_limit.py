@@ -0,0 +1,133 @@
+import threading
+import time
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_MAX_RATE = 50.0        # requests per second the limiter will never exceed
+DEFAULT_MIN_RATE = 1.0
+DEFAULT_LATENCY_FACTOR = 3.0   # back off when latency runs this many times above the best seen...
+DEFAULT_LATENCY_SLACK = 0.5    # ...and at least this many seconds above it, so fast jittery responses don't count
+DEFAULT_COOLDOWN = 2.0         # seconds between two decreases, so one burst of errors halves once
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Callers reserve a token and sleep for the returned delay,
+    which lets the same bucket pace both blocking threads and asyncio tasks.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            self.burst = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Takes one token and returns how many seconds the caller must wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1.0
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class AIMDController:
+    """
+    Adjusts request rate and concurrency from what the registry tells us: additive increase
+    while requests succeed quickly, multiplicative decrease on 429/5xx or when latency climbs
+    well above the best latency observed.
+    """
+
+    def __init__(self, max_concurrency, max_rate=DEFAULT_MAX_RATE, min_rate=DEFAULT_MIN_RATE,
+                 latency_factor=DEFAULT_LATENCY_FACTOR, latency_slack=DEFAULT_LATENCY_SLACK,
+                 cooldown=DEFAULT_COOLDOWN):
+        self.max_concurrency = max_concurrency
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.latency_factor = latency_factor
+        self.latency_slack = latency_slack
+        self.cooldown = cooldown
+        # Start in the middle and let successes earn the rest
+        self._concurrency = max(1.0, max_concurrency / 2)
+        self.bucket = TokenBucket(max(min_rate, max_rate / 2))
+        self._best_latency = None
+        self._avg_latency = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def set_limits(self, max_concurrency, max_rate):
+        """Changes the ceilings; the current concurrency and rate are lowered to them if above."""
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self.max_rate = float(max_rate)
+            self._concurrency = min(self._concurrency, float(max_concurrency))
+            if self.bucket.rate > self.max_rate:
+                self.bucket.set_rate(max(self.min_rate, self.max_rate))
+
+    @property
+    def concurrency(self):
+        return int(self._concurrency)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def record(self, latency, status=200):
+        """Feeds one finished request (status None for a network error) into the controller."""
+        with self._lock:
+            self.requests += 1
+            if status == 429:
+                self.throttled += 1
+            if status is None or status == 429 or status >= 500:
+                if status != 429:
+                    self.errors += 1
+                self._decrease(0.5)
+                return
+            self._avg_latency = latency if self._avg_latency is None else 0.8 * self._avg_latency + 0.2 * latency
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+            congested_latency = max(self.latency_factor * self._best_latency, self._best_latency + self.latency_slack)
+            if self._avg_latency > congested_latency:
+                self._decrease(0.75)
+                return
+            # +1 concurrency and +1 req/s per "window" of successful requests
+            self._concurrency = min(self.max_concurrency, self._concurrency + 1.0 / self._concurrency)
+            self.bucket.set_rate(min(self.max_rate, self.bucket.rate + 1.0 / max(1.0, self.bucket.rate)))
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._concurrency = max(1.0, self._concurrency * factor)
+        self.bucket.set_rate(max(self.min_rate, self.bucket.rate * factor))
+        # Slowed-down requests should not keep triggering decreases
+        self._avg_latency = self._best_latency
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "max_concurrency": self.max_concurrency,
+                "rate": round(self.bucket.rate, 2),
+                "max_rate": self.max_rate,
+                "avg_latency_ms": round((self._avg_latency or 0) * 1000, 1),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "errors": self.errors,
+            }
@@ -0,0 +1,128 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+
+from npi_cache import norm
+from npi_registry import RegistryError
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_CASSETTE_PATH = os.environ.get("NPI_CASSETTE_PATH", "npi_registry.cassette.json.gz")
+DEFAULT_CASSETTE_MODE = os.environ.get("NPI_CASSETTE_MODE", "passthrough")
+CASSETTE_MODES = ("passthrough", "record", "replay")
+CASSETTE_VERSION = 1
+
+
+def page_key(params):
+    """
+    Identifies one registry page request. Names and state are case- and whitespace-insensitive,
+    like the response cache keys, so a replay matches however the roster spelled them.
+    """
+    return "|".join(f"{name}={norm(params[name])}" for name in sorted(params))
+
+
+class RegistryCassette:
+    """
+    Archive of registry page requests and their results, kept in memory and saved as gzip'd
+    JSON. In "record" mode every page fetched from the registry is added to it; in "replay"
+    mode pages are only ever served from it, so a run needs no network at all.
+    """
+
+    def __init__(self, path=DEFAULT_CASSETTE_PATH, mode="replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._file_mtime = None  # of the file as last read or written by this instance
+        self.replayed = 0
+        self.recorded = 0
+        self.missing = 0
+        if os.path.exists(path):
+            self.refresh()
+        elif mode == "replay":
+            raise FileNotFoundError(f"Registry cassette not found: {path}")
+
+    def refresh(self):
+        """
+        Merges in the pages saved to the file since this instance last read or wrote it, e.g. by
+        another process recording to the same file. Pages held in memory take precedence.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._file_mtime:
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"{self.path} is a version {saved.get('version')} cassette, expected {CASSETTE_VERSION}")
+        with self._lock:
+            self._pages = {**saved.get("pages", {}), **self._pages}
+            self._file_mtime = mtime
+
+    def replay(self, params):
+        """The recorded results of a page request; raises RegistryError if it was never recorded."""
+        with self._lock:
+            results = self._pages.get(page_key(params))
+            if results is None:
+                self.missing += 1
+                raise RegistryError(f"not in the registry cassette {os.path.basename(self.path)}")
+            self.replayed += 1
+            return list(results)
+
+    def record(self, params, results):
+        with self._lock:
+            self._pages[page_key(params)] = list(results)
+            self._dirty = True
+            self.recorded += 1
+
+    def save(self):
+        """
+        Writes the cassette (atomically) if anything was recorded since the last save, keeping
+        the pages other writers saved to the file in the meantime.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+            self.refresh()
+            with self._lock:
+                saved = {"version": CASSETTE_VERSION, "pages": dict(self._pages)}
+                self._dirty = False
+            # A temporary file of its own, so concurrent saves from other processes never interleave
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)),
+                                             prefix=os.path.basename(self.path) + ".", suffix=".tmp",
+                                             delete=False) as tmp:
+                with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                    json.dump(saved, f, separators=(",", ":"))
+            try:
+                os.replace(tmp.name, self.path)
+            except OSError:
+                os.remove(tmp.name)
+                raise
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "pages": len(self._pages),
+                "replayed": self.replayed,
+                "recorded": self.recorded,
+                "missing": self.missing,
+            }
+
+
+def open_cassette(mode=DEFAULT_CASSETTE_MODE, path=DEFAULT_CASSETTE_PATH):
+    """A RegistryCassette for "record" or "replay", or None for "passthrough" (talk to the registry as usual)."""
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Unknown cassette mode {mode!r}; expected one of {', '.join(CASSETTE_MODES)}")
+    if mode == "passthrough":
+        return None
+    return RegistryCassette(path, mode)
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+# -------------------- CONFIG & CONSTANTS --------------------
+# Filter name -> result columns it looks at; a row passes if any of them holds a selected value
+FILTER_COLUMNS = {
+    "state": ("State_1", "State_2", "State_3"),
+    "specialty": ("Specialty_1", "Specialty_2"),
+    "match_level": ("Match_Level",),
+    "hospital": ("Matched Hospital",),
+}
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORICAL_MAX_UNIQUE_SHARE = 0.5
+# A provider's result rows share the roster row number (and are contiguous, best match first);
+# results saved without one are grouped on the supplied name and specialty instead
+PROVIDER_COLUMN = "Row_ID"
+FALLBACK_PROVIDER_COLUMNS = ("First_Name_Supplied", "Last_Name_Supplied", "Specialty_Supplied")
+SUMMARY_COLUMNS = [
+    "FIRST_LAST", "Specialty_Supplied", "Match_Level", "NPI", "First_Name", "Last_Name", "Specialty_1",
+    "State_1", "Matched Hospital",
+]
+MATCH_LEVEL_ORDER = ["Best", "Good", "Potential", "Limited Potential", "No Match"]
+# Summary sort choices -> column to sort on (None: roster order)
+SUMMARY_SORTS = {
+    "Roster order": None,
+    "Provider": "FIRST_LAST",
+    "Match level": "Match_Level",
+    "Candidates": "Candidates",
+    "Top NPI": "NPI",
+    "Hospital": "Matched Hospital",
+}
+
+
+def to_categoricals(df, max_unique_share=CATEGORICAL_MAX_UNIQUE_SHARE):
+    """df with its repetitive text columns (states, specialties, cities, match levels...) as categoricals."""
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            if series.nunique(dropna=True) <= max_unique_share * len(series):
+                converted[column] = series.astype("category")
+    return df.assign(**converted) if converted else df
+
+
+class ResultStore:
+    """
+    A matching run's results, converted once for the filter panel: repetitive columns become
+    categoricals, every filter's options are precomputed, and each filter has an inverted index
+    (value -> sorted row positions). Filtering is then a union of position arrays per filter
+    and an intersection across filters, instead of .isin scans over every row on each rerun.
+    Rows are also numbered by provider, for the per-provider summary of the results view.
+    """
+
+    def __init__(self, df, filter_columns=None):
+        self.df = to_categoricals(df.reset_index(drop=True))
+        self.filter_columns = filter_columns or FILTER_COLUMNS
+        self.index = {name: self._build_index(columns) for name, columns in self.filter_columns.items()}
+        self.options = {name: sorted(index) for name, index in self.index.items()}
+        if PROVIDER_COLUMN in self.df.columns and self.df[PROVIDER_COLUMN].notna().all():
+            provider_columns = [PROVIDER_COLUMN]
+        else:
+            provider_columns = [c for c in FALLBACK_PROVIDER_COLUMNS if c in self.df.columns]
+        # Provider ids number providers in order of first appearance, i.e. in roster order
+        self.provider_ids = (
+            self.df.groupby(provider_columns, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        )
+
+    def _build_index(self, columns):
+        positions = {}
+        for column in columns:
+            if column not in self.df.columns:
+                continue
+            values = self.df[column]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype("category")
+            codes = values.cat.codes.to_numpy()
+            # Group row positions by category code with one stable sort: each code's rows are contiguous
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values.cat.categories) + 1))
+            for code, value in enumerate(values.cat.categories):
+                if bounds[code] < bounds[code + 1] and str(value).strip():
+                    positions.setdefault(value, []).append(order[bounds[code]:bounds[code + 1]])
+        return {
+            value: arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays))
+            for value, arrays in positions.items()
+        }
+
+    def __len__(self):
+        return len(self.df)
+
+    def rows(self, **selected):
+        """Sorted positions of the rows passing every filter given a non-empty selection."""
+        matched = None
+        for name, values in selected.items():
+            if not values:
+                continue
+            index = self.index[name]
+            arrays = [index[value] for value in values if value in index]
+            rows = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.intp)
+            matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+        return np.arange(len(self.df)) if matched is None else matched
+
+    def take(self, rows):
+        """The result rows at `rows`, as a DataFrame (the whole result if that is all of them)."""
+        return self.df if len(rows) == len(self.df) else self.df.iloc[rows]
+
+    def summary(self, rows, sort_by=None, descending=False):
+        """
+        One line per provider among `rows`: their top match (first result row), plus how many
+        candidates they have there. Indexed by provider id and sorted on `sort_by`, a column of
+        the summary (None: roster order).
+        """
+        providers = self.provider_ids[rows]
+        provider_ids, first, counts = np.unique(providers, return_index=True, return_counts=True)
+        columns = [c for c in SUMMARY_COLUMNS if c in self.df.columns]
+        summary = self.df.iloc[rows[first]][columns].reset_index(drop=True)
+        summary.index = provider_ids
+        no_match = summary["Match_Level"].astype(str).to_numpy() == "No Match" if "Match_Level" in summary else False
+        summary["Candidates"] = np.where(no_match, 0, counts)
+        if sort_by is None:
+            return summary.iloc[::-1] if descending else summary
+        key = None
+        if sort_by == "Match_Level":
+            rank = {level: i for i, level in enumerate(MATCH_LEVEL_ORDER)}
+            key = lambda levels: levels.astype(str).map(lambda level: rank.get(level, len(rank)))
+        elif isinstance(summary[sort_by].dtype, pd.CategoricalDtype):
+            key = lambda values: values.astype(str)  # by value, not by category order
+        return summary.sort_values(sort_by, ascending=not descending, kind="stable", key=key)
+
+    def candidates(self, provider_id, rows):
+        """The result rows among `rows` of one provider, best match first."""
+        return self.df.iloc[rows[self.provider_ids[rows] == provider_id]]
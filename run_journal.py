@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from sqlite_local import ThreadLocalConnection
+
+# -------------------- CONFIG & CONSTANTS --------------------
+DEFAULT_JOURNAL_PATH = os.environ.get("NPI_JOURNAL_PATH", ".npi_runs.sqlite3")
+DEFAULT_MAX_RUNS = 20  # older runs are dropped when a new one starts
+
+
+def make_run_id(upload_bytes, settings):
+    """
+    Identifies a run by the uploaded file's content and the settings that change its results,
+    so the same roster matched the same way always maps to the same journal entry.
+    """
+    sha = hashlib.sha256(upload_bytes)
+    sha.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class RunJournal:
+    """
+    SQLite journal of matching runs. Every finished roster row's result rows are stored as
+    soon as the row completes, so an interrupted run can pick up where it stopped.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, max_runs=DEFAULT_MAX_RUNS):
+        self.path = path
+        self.max_runs = max_runs
+        self._connect = ThreadLocalConnection(path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " settings TEXT NOT NULL,"
+                " total_rows INTEGER NOT NULL,"
+                " finished INTEGER NOT NULL DEFAULT 0,"
+                " created REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS run_rows ("
+                " run_id TEXT NOT NULL,"
+                " row_index INTEGER NOT NULL,"
+                " payload BLOB NOT NULL,"
+                " PRIMARY KEY (run_id, row_index))"
+            )
+
+    def start(self, run_id, total_rows, settings):
+        """Registers a run (keeping rows already journaled for it) and drops the oldest runs."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO runs (run_id, settings, total_rows, finished, created, updated) VALUES (?, ?, ?, 0, ?, ?)"
+                " ON CONFLICT (run_id) DO UPDATE SET finished = 0, updated = excluded.updated",
+                (run_id, json.dumps(settings, sort_keys=True, default=str), total_rows, now, now),
+            )
+            old_runs = [r for (r,) in conn.execute(
+                "SELECT run_id FROM runs ORDER BY updated DESC LIMIT -1 OFFSET ?", (self.max_runs,)
+            )]
+            for old_run in old_runs:
+                conn.execute("DELETE FROM run_rows WHERE run_id = ?", (old_run,))
+                conn.execute("DELETE FROM runs WHERE run_id = ?", (old_run,))
+
+    def record(self, run_id, rows):
+        """Stores {row_index: result_rows} for finished roster rows in one transaction."""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO run_rows (run_id, row_index, payload) VALUES (?, ?, ?)",
+                [
+                    (run_id, row_index, zlib.compress(json.dumps(result_rows, default=str).encode("utf-8")))
+                    for row_index, result_rows in rows.items()
+                ],
+            )
+            conn.execute("UPDATE runs SET updated = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def finish(self, run_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE runs SET finished = 1, updated = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def completed_rows(self, run_id):
+        """{row_index: result_rows} of every roster row already journaled for the run."""
+        return {
+            row_index: json.loads(zlib.decompress(payload))
+            for row_index, payload in self._connect().execute(
+                "SELECT row_index, payload FROM run_rows WHERE run_id = ?", (run_id,)
+            )
+        }
+
+    def status(self, run_id):
+        """{"done", "total", "finished"} for a journaled run, or None if there is none."""
+        conn = self._connect()
+        run = conn.execute("SELECT total_rows, finished FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if run is None:
+            return None
+        done = conn.execute("SELECT COUNT(*) FROM run_rows WHERE run_id = ?", (run_id,)).fetchone()[0]
+        return {"done": done, "total": run[0], "finished": bool(run[1])}
+
+    def discard(self, run_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM run_rows WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
@@ -0,0 +1,168 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# -------------------- CONFIG & CONSTANTS --------------------
+# Upper bounds (seconds) of the latency histogram buckets; slower observations go in a last bucket
+HISTOGRAM_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: constant memory and a bisect per observation."""
+
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (the max for the last bucket)."""
+        count = sum(self.counts)
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(HISTOGRAM_BOUNDS[i], self.max) if i < len(HISTOGRAM_BOUNDS) else self.max
+        return self.max
+
+    def merge(self, snapshot):
+        self.counts = [a + b for a, b in zip(self.counts, snapshot["buckets"])]
+        self.total += snapshot["sum"]
+        self.max = max(self.max, snapshot["max"])
+
+    def snapshot(self):
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "sum": round(self.total, 6),
+            "mean": round(self.total / count, 6) if count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "max": round(self.max, 6),
+            "buckets": list(self.counts),
+        }
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class RunMetrics:
+    """
+    Counters and latency histograms of one matching run, labeled by strategy, state and the
+    like. Safe to update from every row worker; snapshot() is the JSON-ready export, and
+    merge() folds in the snapshot of a worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._histograms = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+        self.elapsed = None
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def strategy(self, match_level):
+        """Times one strategy pass; registry pages loaded inside it are labeled with the strategy."""
+        previous = getattr(self._local, "strategy", None)
+        self._local.strategy = match_level
+        try:
+            with self.timer("strategy_seconds", strategy=match_level):
+                yield
+        finally:
+            self._local.strategy = previous
+
+    @property
+    def current_strategy(self):
+        return getattr(self._local, "strategy", None)
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, series in snapshot["counters"].items():
+                for entry in series:
+                    key = _key(name, entry["labels"])
+                    self._counters[key] = self._counters.get(key, 0) + entry["value"]
+            for name, series in snapshot["histograms"].items():
+                for entry in series:
+                    key = _key(name, entry["labels"])
+                    histogram = self._histograms.get(key)
+                    if histogram is None:
+                        histogram = self._histograms[key] = Histogram()
+                    histogram.merge(entry)
+
+    def total(self, name):
+        """Sum of a counter over all its labels."""
+        with self._lock:
+            return sum(value for (key_name, _), value in self._counters.items() if key_name == name)
+
+    def snapshot(self):
+        with self._lock:
+            counters, histograms = {}, {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.snapshot()})
+            gauges = dict(self.gauges)
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self.started
+        row_seconds = sum(entry["sum"] for entry in histograms.get("row_seconds", []))
+        workers = gauges.get("row_workers") or 0
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            # Share of the row workers' wall time spent matching rows rather than idle
+            "thread_utilization": round(row_seconds / (elapsed * workers), 3) if elapsed > 0 and workers else None,
+            "gauges": gauges,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, default=str)
+
+
+def cache_delta(before, after):
+    """Hits, misses and hit rate of a cache between two stats() snapshots."""
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    return {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0}
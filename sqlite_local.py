@@ -0,0 +1,28 @@
+import sqlite3
+import threading
+
+
+class ThreadLocalConnection:
+    """
+    Callable returning this thread's connection to one SQLite file, opened on first use.
+    One connection per thread; sqlite3 connections must not cross threads. Writable
+    databases use WAL, so readers in other threads and processes never block a writer.
+    """
+
+    def __init__(self, path, read_only=False, timeout=30):
+        self.path = path
+        self.read_only = read_only
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=self.timeout)
+            else:
+                conn = sqlite3.connect(self.path, timeout=self.timeout)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,29 @@
+import types
+
+import pytest
+
+
+class Clock:
+    """Stands in for the time module: time() and monotonic() read `now`, which moves `step` per read."""
+
+    def __init__(self, now=1000.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def time(self):
+        self.now += self.step
+        return self.now
+
+    monotonic = time
+
+
+@pytest.fixture
+def patch_clock(monkeypatch):
+    """Replaces a module's `time` with a Clock it then returns: patch_clock(module, step=0.0)."""
+
+    def patch(module, **kwargs):
+        clock = Clock(**kwargs)
+        monkeypatch.setattr(module, "time", types.SimpleNamespace(time=clock.time, monotonic=clock.monotonic))
+        return clock
+
+    return patch
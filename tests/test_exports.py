@@ -0,0 +1,52 @@
+import io
+
+import pandas as pd
+import pytest
+
+import exports
+from exports import EXPORT_FORMATS, excel_bytes, write_excel
+from npi_matcher import write_results
+
+
+@pytest.fixture
+def results():
+    return pd.DataFrame({
+        "Row_ID": [0, 1, 2],
+        "NPI": ["0012345678", "=1+1", None],  # kept as text: no numbers, formulas or NaN errors
+        "Score": [98.5, float("nan"), 70.0],
+        "Matched Hospital": ["Albany Medical Center", "", "http://example.org"],
+    })
+
+
+def test_excel_round_trip(results):
+    read = pd.read_excel(io.BytesIO(excel_bytes(results)), sheet_name="Results", dtype={"NPI": str})
+    pd.testing.assert_frame_equal(read, results.replace("", None), check_dtype=False)
+
+
+def test_write_excel_refuses_more_rows_than_a_worksheet_holds(results, monkeypatch, tmp_path):
+    monkeypatch.setattr(exports, "EXCEL_MAX_ROWS", 3)  # the header takes the third row
+    with pytest.raises(ValueError, match="do not fit in one Excel worksheet"):
+        write_excel(results, str(tmp_path / "results.xlsx"))
+    write_excel(results.head(2), str(tmp_path / "results.xlsx"))
+
+
+@pytest.mark.parametrize("label", list(EXPORT_FORMATS))
+def test_export_formats_round_trip(results, label, tmp_path):
+    build, extension, _ = EXPORT_FORMATS[label]
+    path = tmp_path / f"results.{extension}"
+    path.write_bytes(build(results))
+    read = {
+        "xlsx": lambda: pd.read_excel(path, dtype={"NPI": str}),
+        "csv.gz": lambda: pd.read_csv(path, dtype={"NPI": str}),
+        "parquet": lambda: pd.read_parquet(path),
+    }[extension]()
+    assert read["NPI"].tolist()[:2] == ["0012345678", "=1+1"]
+    assert len(read) == len(results)
+
+
+def test_write_results_writes_xlsx_and_refuses_xls(results, tmp_path):
+    write_results(results, str(tmp_path / "results.xlsx"))
+    assert pd.read_excel(tmp_path / "results.xlsx", dtype={"NPI": str})["NPI"].tolist()[:2] == ["0012345678", "=1+1"]
+    with pytest.raises(ValueError, match="legacy .xls"):
+        write_results(results, str(tmp_path / "results.xls"))
+    assert not (tmp_path / "results.xls").exists()
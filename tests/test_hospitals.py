@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from hospitals import (
+    ARTIFACT_VERSION, HospitalIndex, HospitalMatchCache, build_hospital_artifact, file_checksum, load_hospital_df,
+    open_hospital_index, read_manifest,
+)
+
+HOSPITALS = """Hospital,Address,City,State
+Albany Medical Center,43 New Scotland Ave,Albany,NY
+St. Peter's Hospital,315 S Manning Blvd,Albany,NY
+Albany Memorial,600 Northern Blvd,albany,ny
+Ellis Hospital,1101 Nott St,Schenectady,NY
+Albany Regional,43 New Scotland Avenue,Albany,GA
+"""
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "hospitals.csv"
+    path.write_text(HOSPITALS)
+    return str(path)
+
+
+@pytest.fixture
+def index(source):
+    return HospitalIndex.from_df(load_hospital_df(source))
+
+
+def test_find_only_scores_the_same_city_and_state(index):
+    assert index.find("43 New Scotland Ave.", "albany ", "NY") == "Albany Medical Center"
+    assert index.find("43 New Scotland Ave", "Albany", "GA") == "Albany Regional"
+    assert index.find("600 Northern Blvd", "Albany", "NY") == "Albany Memorial"  # normalized city and state
+    assert index.find("1101 Nott St", "Albany", "NY") == ""  # that hospital is in Schenectady
+    assert index.find("43 New Scotland Ave", "Troy", "NY") == ""  # no such block
+    assert index.find("1 Unrelated Rd", "Albany", "NY") == ""  # below the threshold
+
+
+def test_find_many_returns_what_find_does(source):
+    lookups = [
+        ("43 New Scotland Ave", "Albany", "NY"), ("315 S. Manning Blvd", "ALBANY", "ny"),
+        ("1101 Nott St", "Schenectady", "NY"), ("1101 Nott St", "Albany", "NY"), ("", "", ""),
+        ("43 New Scotland Ave", "Albany", "GA"), ("43 New Scotland Ave", "Albany", "NY"),
+    ]
+    expected = [HospitalIndex.from_df(load_hospital_df(source)).find(*lookup) for lookup in lookups]
+    cache = HospitalMatchCache()
+    index = HospitalIndex.from_df(load_hospital_df(source), cache)
+    assert index.find_many(lookups) == expected
+    assert cache.stats()["entries"] == 5  # only lookups in a known block are scored and cached
+    assert index.find_many(lookups) == expected  # and again from the cache
+
+
+def test_stale_artifact_is_rebuilt(source, tmp_path):
+    artifact_dir = str(tmp_path / "hospitals.index")
+    build_hospital_artifact(source, artifact_dir)
+    assert read_manifest(artifact_dir) == {
+        "version": ARTIFACT_VERSION, "source": "hospitals.csv", "checksum": file_checksum(source),
+        "rows": 5, "blocks": 3,
+    }
+
+    with open(source, "a") as f:
+        f.write("Samaritan Hospital,2215 Burdett Ave,Troy,NY\n")
+    index = open_hospital_index(source, artifact_dir, str(tmp_path / "matches.json.gz"))
+    assert read_manifest(artifact_dir)["checksum"] == file_checksum(source)
+    assert index.find("2215 Burdett Avenue", "Troy", "NY") == "Samaritan Hospital"
+    assert index.find("43 New Scotland Ave", "Albany", "NY") == "Albany Medical Center"
+    assert sorted(os.listdir(tmp_path)) == ["hospitals.csv", "hospitals.index"]  # no build directories left over
@@ -0,0 +1,64 @@
+import pytest
+
+import npi_cache
+from npi_cache import NPIResponseCache, make_cache_key
+
+
+@pytest.fixture
+def clock(patch_clock):
+    return patch_clock(npi_cache)
+
+
+def response(count):
+    return {"result_count": count, "results": [{"number": str(i)} for i in range(count)]}
+
+
+def make_cache(tmp_path, **kwargs):
+    return NPIResponseCache(str(tmp_path / "cache.sqlite3"), **kwargs)
+
+
+def test_cache_key_ignores_case_and_whitespace():
+    assert make_cache_key(" John ", "SMITH", "ny") == make_cache_key("john", "smith", "NY")
+    assert make_cache_key("Mary  Ann", "Lee", "") == make_cache_key("mary ann", "lee", None)
+    assert make_cache_key("John", "Smith", "NY") != make_cache_key("John", "Smith", "NJ")
+
+
+def test_hit_until_ttl_expires(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100, negative_ttl=10)
+    cache.set("k", response(2))
+    clock.now += 99
+    assert cache.get("k") == response(2)
+    clock.now += 1
+    assert cache.get("k") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expired"], stats["entries"]) == (1, 1, 1, 0)
+
+
+def test_zero_result_responses_use_negative_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100, negative_ttl=10)
+    cache.set("empty", response(0))
+    cache.set("found", response(1))
+    clock.now += 10
+    assert cache.get("empty") is None
+    assert cache.get("found") == response(1)
+
+
+def test_evict_drops_least_recently_used(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=1000)
+    for key in ("a", "b", "c"):
+        cache.set(key, response(1))
+        clock.now += 1
+    cache.get("a")  # "b" is now the least recently used
+    cache.max_entries = 2
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_set_evicts_in_batches(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    for key in ("a", "b", "c", "d"):
+        clock.now += 1
+        cache.set(key, response(1))
+    assert cache.stats()["entries"] == 2
+    assert cache.get("a") is None and cache.get("d") is not None
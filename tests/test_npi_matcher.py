@@ -0,0 +1,146 @@
+import pytest
+
+from benchmarks.fake_registry import FakeRegistry, FakeRegistryServer
+from npi_cache import NPIResponseCache
+from npi_matcher import CandidatePool, RegistryLookup, RowCandidates, fetch_for_states, fuzzy_strategy
+from npi_registry import AsyncRegistryEngine
+
+
+def provider(number, first, last, *states):
+    return {
+        "number": str(number),
+        "enumeration_type": "NPI-1",
+        "basic": {"first_name": first, "last_name": last, "middle_name": "", "credential": "MD"},
+        "taxonomies": [{"desc": "Internal Medicine"}],
+        "addresses": [{"address_purpose": "LOCATION", "address_1": "1 Main St", "city": "Albany", "state": state}
+                      for state in states],
+        "other_names": [],
+    }
+
+
+def counters(metrics, name):
+    return {tuple(sorted(entry["labels"].items())): entry["value"] for entry in metrics.snapshot()["counters"][name]}
+
+
+def test_prefetch_counts_queries_and_pages_by_strategy_and_state():
+    registry = FakeRegistry([provider(1, "John", "Smith", "NY"), provider(2, "John", "Smith", "NJ")])
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    pool.prefetch([("John", "Smith", ""), ("Ann", "Lee", "NY")])
+    pool.prefetch([("John", "Smith", ""), ("Ann", "Lee", "NJ")])
+    assert pool.fetches == 3
+    assert counters(pool.metrics, "prefetched_queries") == {
+        (("state", "ALL"), ("strategy", "Best")): 1,
+        (("state", "NJ"), ("strategy", "Best")): 1,
+        (("state", "NY"), ("strategy", "Best")): 1,
+    }
+    assert sum(counters(pool.metrics, "prefetched_pages").values()) == 3
+    assert [r.number for r in pool.get_paged("John", "Smith", "")] == ["1", "2"]
+    assert pool.fetches == 3  # read from the prefetched entry
+
+
+# -------------------- NATIONWIDE QUERIES --------------------
+def recording_fetch(pool):
+    calls = []
+
+    def fetch(first, last, state):
+        calls.append(state)
+        return pool.get(first, last, state)
+
+    return fetch, calls
+
+
+def per_state(pool, first, last, states):
+    return [r.number for s in states for r in pool.get(first, last, s)["results"]]
+
+
+def test_full_name_states_come_from_one_nationwide_query():
+    registry = FakeRegistry([provider(1, "John", "Smith", "NJ"), provider(2, "John", "Smith", "NY", "NJ"),
+                             provider(3, "John", "Smith", "CT"), provider(4, "John", "Smith", "NY")])
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    fetch, calls = recording_fetch(pool)
+    records = fetch_for_states(fetch, "John", "Smith", ["NY", "NJ"])
+    assert calls == [""]
+    # Same records, in the same order, as querying NY and then NJ
+    assert [r.number for r in records] == per_state(pool, "John", "Smith", ["NY", "NJ"]) == ["2", "4", "1", "2"]
+
+
+def test_truncated_nationwide_query_falls_back_to_per_state_queries():
+    registry = FakeRegistry([provider(i, "John", "Smith", "NY") for i in range(450)]
+                            + [provider(1000 + i, "John", "Smith", "NJ") for i in range(100)])
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    fetch, calls = recording_fetch(pool)
+    records = fetch_for_states(fetch, "John", "Smith", ["NJ", "NY"])
+    assert calls == ["", "NJ", "NY"]
+    assert [r.number for r in records] == per_state(pool, "John", "Smith", ["NJ", "NY"])
+    assert len(records) == 550  # more than the nationwide result could hold
+
+
+def test_partial_names_are_queried_per_state():
+    registry = FakeRegistry([provider(1, "John", "Smith", "NY"), provider(2, "Ann", "Smith", "NJ")])
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    fetch, calls = recording_fetch(pool)
+    assert [r.number for r in fetch_for_states(fetch, "", "Smith", ["NY", "NJ"])] == ["1", "2"]
+    assert calls == ["NY", "NJ"]
+
+
+class CountingEngine:
+    """Registry engine stand-in answering from a FakeRegistry, recording every query it gets."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.queries = []
+
+    def query(self, first, last, state, version=2.1, max_results=500, cassette=None):
+        self.queries.append((first, last, state))
+        return self.registry.query(first, last, state, version, max_results)
+
+
+def test_state_queries_are_answered_from_a_cached_nationwide_result(tmp_path):
+    registry = FakeRegistry([provider(1, "John", "Smith", "NY"), provider(2, "John", "Smith", "NJ")]
+                            + [provider(100 + i, "Ann", "Lee", "NY", "NJ") for i in range(500)])
+    engine = CountingEngine(registry)
+    lookup = RegistryLookup(engine=engine, cache=NPIResponseCache(str(tmp_path / "cache.sqlite3")))
+
+    nationwide = lookup.query("John", "Smith", "")
+    response = lookup.query(" john", "SMITH ", "nj")
+    assert [r["number"] for r in response["results"]] == ["2"] and response["result_count"] == 1
+    assert lookup.query("John", "Smith", "TX") == {"results": [], "result_count": 0}
+    assert engine.queries == [("John", "Smith", "")]
+    assert nationwide["result_count"] == 2
+
+    # A nationwide result cut off at max_results cannot answer a state: that is queried itself
+    lookup.query("Ann", "Lee", "")
+    lookup.query("Ann", "Lee", "NJ")
+    assert engine.queries[1:] == [("Ann", "Lee", ""), ("Ann", "Lee", "NJ")]
+    assert lookup.stats()["cache_hits"] == 2
+
+
+# -------------------- EARLY STOP --------------------
+@pytest.fixture
+def shah_server():
+    # 450 NY Shahs: three registry pages (200, 200, 50) when read to the end
+    registry = FakeRegistry([provider(5000 + i, f"Name{i}", "Shah", "NY") for i in range(450)])
+    with FakeRegistryServer(registry) as server:
+        yield server
+
+
+@pytest.fixture
+def engine_pool(shah_server):
+    engine = AsyncRegistryEngine(max_concurrency=2, url=shah_server.url, max_retries=0)
+    yield CandidatePool(RegistryLookup(engine=engine))
+    engine.close()
+
+
+def test_fuzzy_strategy_stops_after_the_page_with_limit_top_matches(shah_server, engine_pool):
+    row = {"First Name": "Priya", "Last Name": "Shah"}
+    matches = fuzzy_strategy("Potential", row, RowCandidates(engine_pool, ["NY"]), "", limit=5)
+    assert shah_server.requests == 1
+    assert len(matches) == 5
+
+
+def test_fuzzy_strategy_reads_every_page_when_the_limit_is_not_reached(shah_server, engine_pool):
+    row = {"First Name": "Priya", "Last Name": "Shah"}
+    matches = fuzzy_strategy("Potential", row, RowCandidates(engine_pool, ["NY"]), "", limit=1000)
+    assert shah_server.requests == 3
+    assert len(matches) == 450
+
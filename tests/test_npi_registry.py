@@ -0,0 +1,166 @@
+import os
+
+import pytest
+
+import npi_registry
+from benchmarks.fake_registry import ROSTER_FILE, FakeRegistry, FakeRegistryServer, canned_records
+from hospitals import HOSPITAL_FILE
+from npi_registry import (
+    REGISTRY_MAX_SKIP, REGISTRY_PAGE_LIMIT, AsyncRegistryEngine, RegistryError, backoff_delay, page_plan, parse_page,
+)
+
+
+def record(number, first, last, state):
+    return {"number": str(number), "basic": {"first_name": first, "last_name": last},
+            "addresses": [{"address_purpose": "LOCATION", "state": state}]}
+
+
+@pytest.fixture
+def registry():
+    return FakeRegistry([record(1, "JOHN", "SMITH", "NY"), record(2, "JOHN", "SMITH", "NJ")])
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """The (attempt, Retry-After) of every backoff, which then returns at once."""
+    calls = []
+
+    def no_wait(attempt, retry_after=None):
+        calls.append((attempt, retry_after))
+        return 0.0
+
+    monkeypatch.setattr(npi_registry, "backoff_delay", no_wait)
+    return calls
+
+
+def query(server, max_retries, *args):
+    engine = AsyncRegistryEngine(max_concurrency=2, url=server.url, max_retries=max_retries)
+    try:
+        return engine.query(*args), engine.controller.snapshot()
+    finally:
+        engine.close()
+
+
+def test_parse_page():
+    assert parse_page(200, {"result_count": 1, "results": [{"number": "1"}]}) == [{"number": "1"}]
+    assert parse_page(200, {"result_count": 0}) == []
+    assert parse_page(503, None) is None  # retried
+    assert parse_page(429, {"Errors": ["slow down"]}) is None  # retried
+    assert parse_page(200, None) is None  # a non-JSON body is retried too
+    with pytest.raises(RegistryError, match="HTTP 404"):
+        parse_page(404, None)
+    with pytest.raises(RegistryError, match="No valid search criteria"):
+        parse_page(200, {"Errors": [{"description": "No valid search criteria provided"}]})
+
+
+def test_backoff_honors_retry_after():
+    assert 0 <= backoff_delay(0) <= 0.5
+    assert backoff_delay(0, retry_after="3") >= 3
+    assert backoff_delay(10, cap=2.0) <= 2.0
+    assert backoff_delay(0, retry_after="Wed, 21 Oct 2015 07:28:00 GMT") <= 0.5  # dates are ignored
+
+
+def test_gives_up_after_the_last_attempt(registry, backoffs):
+    with FakeRegistryServer(registry, error_rate=1.0) as server:
+        response, snapshot = query(server, 2, "John", "Smith", "")
+    assert server.requests == 3
+    assert response == {"results": [], "result_count": 0, "error": "HTTP 503 after 3 attempts"}
+    assert [attempt for attempt, _ in backoffs] == [0, 1]
+    assert snapshot["errors"] == 3
+
+
+def test_throttling_is_retried_after_retry_after(registry, backoffs):
+    with FakeRegistryServer(registry, throttle_rate=1.0) as server:
+        response, snapshot = query(server, 1, "John", "Smith", "")
+    assert server.requests == 2
+    assert response["error"] == "HTTP 429 after 2 attempts"
+    assert backoffs == [(0, "1")]
+    assert snapshot["throttled"] == 2  # the 429 body is plain text, but its status still counts
+
+
+def test_transient_errors_are_retried_until_a_page_loads(registry, backoffs):
+    with FakeRegistryServer(registry, error_rate=0.3, throttle_rate=0.1) as server:
+        responses = [query(server, 4, "John", "Smith", "")[0] for _ in range(5)]
+        stats = server.stats()
+    assert all(r == responses[0] for r in responses) and "error" not in responses[0]
+    assert [r["number"] for r in responses[0]["results"]] == ["1", "2"]
+    assert stats["errors"] + stats["throttled"] > 0
+    assert stats["requests"] == 5 + stats["errors"] + stats["throttled"] == 5 + len(backoffs)
+
+
+def test_rejected_queries_are_not_retried(registry, backoffs):
+    with FakeRegistryServer(registry) as server:
+        response, _ = query(server, 4, "", "", "NY")
+    assert server.requests == 1 and backoffs == []
+    assert response["error"] == "Registry rejected query: No valid search criteria provided"
+
+
+# -------------------- ASYNC ENGINE --------------------
+@pytest.fixture(scope="module")
+def padded_registry():
+    # The fake registry's padded surnames span several pages, like the real registry's Shahs
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return FakeRegistry(canned_records(
+        example_path=os.path.join(root, "example_output.csv"),
+        roster_path=os.path.join(root, ROSTER_FILE),
+        hospital_path=os.path.join(root, HOSPITAL_FILE),
+    ))
+
+
+def test_page_plan_stops_at_the_registry_skip_limit():
+    assert page_plan(500) == [(0, 200), (200, 200), (400, 100)]
+    assert page_plan(150) == [(0, 150)]
+    assert page_plan(5000)[-1] == (REGISTRY_MAX_SKIP, REGISTRY_PAGE_LIMIT)
+
+
+def test_query_gathers_the_pages_after_the_first(padded_registry):
+    shahs = padded_registry.matches("", "Shah", "")
+    with FakeRegistryServer(padded_registry) as server:
+        response, _ = query(server, 0, "", "Shah", "")
+        assert server.requests == 3
+        assert [r["number"] for r in response["results"]] == [r["number"] for r in shahs[:500]]
+        assert response["result_count"] == 500
+
+        # 204 in NY: the first page is full, so both remaining pages are requested at once
+        response, _ = query(server, 0, "", "Shah", "NY")
+        assert server.requests == 6
+        assert [r["number"] for r in response["results"]] == [
+            r["number"] for r in padded_registry.matches("", "Shah", "NY")
+        ]
+
+
+def test_query_is_truncated_at_the_registry_skip_limit():
+    many = FakeRegistry([record(i, "JOHN", "SMITH", "NY") for i in range(1500)])
+    engine = AsyncRegistryEngine(max_concurrency=4, max_retries=0)
+    with FakeRegistryServer(many) as server:
+        engine.url = server.url
+        response = engine.query("John", "Smith", "", max_results=2000)
+        assert server.requests == len(page_plan(2000)) == 6
+    engine.close()
+    # Records past skip=1000 plus one page cannot be reached through the API
+    assert response["result_count"] == REGISTRY_MAX_SKIP + REGISTRY_PAGE_LIMIT
+
+
+def test_iter_pages_fetches_only_the_pages_read(padded_registry):
+    engine = AsyncRegistryEngine(max_concurrency=2, max_retries=0)
+    with FakeRegistryServer(padded_registry) as server:
+        engine.url = server.url
+        pages = engine.iter_pages("", "Khan", "")
+        assert len(next(pages)) == REGISTRY_PAGE_LIMIT
+        assert server.requests == 1
+        assert [len(page) for page in pages] == [200, 100]
+        assert server.requests == 3
+    engine.close()
+
+
+def test_close_stops_the_event_loop_and_a_later_query_restarts_it(registry):
+    engine = AsyncRegistryEngine(max_concurrency=2, max_retries=0)
+    with FakeRegistryServer(registry) as server:
+        engine.url = server.url
+        assert engine.query("John", "Smith", "NY")["result_count"] == 1
+        thread = engine._thread
+        engine.close()
+        assert not thread.is_alive() and engine._loop is None
+        engine.close()  # closing twice is fine
+        assert engine.query("John", "Smith", "NJ")["result_count"] == 1
+    engine.close()
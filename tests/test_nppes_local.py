@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from nppes_local import NPPESIndex, build_index
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_NPPES = os.path.join(ROOT, "sample_nppes.csv")
+SAMPLE_TAXONOMY = os.path.join(ROOT, "sample_nucc_taxonomy.csv")
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "nppes.sqlite3")
+    build_index(SAMPLE_NPPES, path, SAMPLE_TAXONOMY)
+    return NPPESIndex(path)
+
+
+def test_build_keeps_active_individual_providers(index):
+    # The organization (NPI-2) and the deactivated provider are dropped
+    assert index.count() == 5
+
+
+def test_query_by_name_and_state(index):
+    response = index.query("John", "Smith", "NY")
+    assert [r["number"] for r in response["results"]] == ["1000000001"]
+    record = response["results"][0]
+    assert record["basic"]["first_name"] == "JOHN"
+    assert [t["desc"] for t in record["taxonomies"]] == ["Internal Medicine, Cardiovascular Disease", "Internal Medicine"]
+    assert record["addresses"][0]["address_purpose"] == "LOCATION"
+    assert record["addresses"][0]["state"] == "NY"
+
+
+def test_query_without_state_is_nationwide(index):
+    numbers = {r["number"] for r in index.query(" john ", "SMITH", "")["results"]}
+    assert numbers == {"1000000001", "1000000002"}
+
+
+def test_build_requires_taxonomy(tmp_path):
+    with pytest.raises(ValueError):
+        build_index(SAMPLE_NPPES, str(tmp_path / "nppes.sqlite3"))
+
+
+def test_provider_listed_twice_is_found_once_per_state(tmp_path):
+    with open(SAMPLE_NPPES, encoding="utf-8") as f:
+        header, *rows = f.read().splitlines()
+    source = tmp_path / "nppes.csv"
+    source.write_text("\n".join([header, *rows, *rows]) + "\n", encoding="utf-8")
+    path = str(tmp_path / "nppes.sqlite3")
+    build_index(str(source), path, SAMPLE_TAXONOMY)
+    index = NPPESIndex(path)
+    assert index.count() == 5
+    assert [r["number"] for r in index.query("John", "Smith", "NY")["results"]] == ["1000000001"]
@@ -0,0 +1,78 @@
+"""
+Matches the CRH roster against the in-process fake registry at every strictness and compares
+each row's matching decisions to a saved snapshot, so a speed-up that changes which providers
+are matched (or how) fails here. After an intended change to matching, regenerate it with
+
+    python -m tests.test_process_row
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.fake_registry import ROSTER_FILE, FakeRegistry, canned_records
+from npi_matcher import STRICTNESS_LABELS, CandidatePool, RegistryLookup, load_roster, process_row
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_row_snapshot.csv")
+SNAPSHOT_COLUMNS = ["Row_ID", "Match_Level", "Specialty_Matched", "Result_Count", "Result", "NPI", "Registry_Status"]
+LIMIT = 5
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return FakeRegistry(canned_records(
+        example_path=os.path.join(ROOT, "example_output.csv"),
+        roster_path=os.path.join(ROOT, ROSTER_FILE),
+        hospital_path=os.path.join(ROOT, "Filtered_Hospitals.csv"),
+    ))
+
+
+@pytest.fixture(scope="module")
+def roster_rows():
+    return load_roster(os.path.join(ROOT, ROSTER_FILE)).to_dict("records")
+
+
+def match_all(registry, roster_rows, strictness):
+    pool = CandidatePool(RegistryLookup(local_index=registry))
+    return pd.DataFrame(
+        [result for row in roster_rows for result in process_row(row, "", LIMIT, STRICTNESS_LABELS[strictness], pool)]
+    )
+
+
+def snapshot_rows(results, strictness):
+    rows = results[SNAPSHOT_COLUMNS].fillna("").astype(str)
+    rows.insert(0, "Strictness", strictness)
+    return rows
+
+
+@pytest.mark.parametrize("strictness", list(STRICTNESS_LABELS))
+def test_process_row_output_is_unchanged(registry, roster_rows, strictness):
+    results = match_all(registry, roster_rows, strictness)
+    snapshot = pd.read_csv(SNAPSHOT_FILE, dtype=str, keep_default_na=False)
+    expected = snapshot[snapshot["Strictness"] == strictness].reset_index(drop=True)
+    pd.testing.assert_frame_equal(snapshot_rows(results, strictness), expected)
+
+
+@pytest.mark.parametrize("strictness", list(STRICTNESS_LABELS))
+def test_every_roster_row_gets_results(registry, roster_rows, strictness):
+    results = match_all(registry, roster_rows, strictness)
+    assert results["Row_ID"].drop_duplicates().tolist() == list(range(len(roster_rows)))
+    assert (results["Registry_Status"] == "OK").all()
+    matched = results[results["Match_Level"] != "No Match"]
+    assert matched.groupby("Row_ID").size().max() <= LIMIT
+    # Matched rows carry the registry record of their NPI
+    records = {record["number"]: record for record in registry.records}
+    assert all(
+        row.First_Name.upper() == records[row.NPI]["basic"]["first_name"].upper()
+        and row.Last_Name.upper() == records[row.NPI]["basic"]["last_name"].upper()
+        for row in matched.itertuples()
+    )
+
+
+if __name__ == "__main__":
+    registry, roster_rows = registry.__wrapped__(), roster_rows.__wrapped__()
+    pd.concat(
+        [snapshot_rows(match_all(registry, roster_rows, strictness), strictness) for strictness in STRICTNESS_LABELS]
+    ).to_csv(SNAPSHOT_FILE, index=False)
+    print(f"Wrote {SNAPSHOT_FILE}")
@@ -0,0 +1,83 @@
+import pytest
+
+import rate_limit
+from rate_limit import AIMDController, TokenBucket
+
+
+@pytest.fixture
+def clock(patch_clock):
+    return patch_clock(rate_limit)
+
+
+def test_bucket_allows_a_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_bucket_refills_at_its_rate_up_to_the_burst(clock):
+    bucket = TokenBucket(rate=2, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 0.5
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() > 0
+    clock.now += 100
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() > 0
+
+
+def test_bucket_set_rate_caps_saved_tokens(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.set_rate(1)
+    assert bucket.burst == 1.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_controller_starts_halfway_and_increases_on_fast_successes(clock):
+    controller = AIMDController(max_concurrency=8, max_rate=20)
+    assert (controller.concurrency, controller.rate) == (4, 10)
+    for _ in range(200):
+        controller.record(0.1)
+    assert (controller.concurrency, controller.rate) == (8, 20)
+
+
+def test_controller_halves_on_throttling_once_per_cooldown(clock):
+    controller = AIMDController(max_concurrency=8, max_rate=20, cooldown=2)
+    controller.record(0.1, status=429)
+    controller.record(0.1, status=503)  # same burst of errors: no second decrease
+    assert (controller.concurrency, controller.rate) == (2, 5)
+    clock.now += 2
+    controller.record(0.1, status=None)
+    assert (controller.concurrency, controller.rate) == (1, 2.5)
+    snapshot = controller.snapshot()
+    assert (snapshot["requests"], snapshot["throttled"], snapshot["errors"]) == (3, 1, 2)
+
+
+def test_controller_backs_off_when_latency_climbs(clock):
+    controller = AIMDController(max_concurrency=8, max_rate=20, min_rate=4)
+    controller.record(0.1)
+    rate = controller.rate
+    for _ in range(10):
+        controller.record(5.0)
+    assert controller.rate == pytest.approx(rate * 0.75)
+    clock.now += 1000
+    for _ in range(20):
+        clock.now += 3
+        controller.record(5.0)
+    assert controller.rate == 4  # never below min_rate
+
+
+def test_controller_set_limits_lowers_current_values(clock):
+    controller = AIMDController(max_concurrency=16, max_rate=40)
+    controller.set_limits(4, 5)
+    assert (controller.concurrency, controller.rate) == (4, 5)
+    for _ in range(200):
+        controller.record(0.1)
+    assert (controller.concurrency, controller.rate) == (4, 5)
+    controller.set_limits(8, 10)
+    for _ in range(200):
+        controller.record(0.1)
+    assert (controller.concurrency, controller.rate) == (8, 10)
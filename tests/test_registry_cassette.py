@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from benchmarks.fake_registry import FakeRegistry, FakeRegistryServer
+from npi_registry import AsyncRegistryEngine, build_params
+from registry_cassette import RegistryCassette, open_cassette
+
+# No server listens here, so a replayed run that touched the network would fail
+UNREACHABLE_URL = "http://127.0.0.1:9/api/"
+
+
+def record(number, first, last, state):
+    return {"number": str(number), "basic": {"first_name": first, "last_name": last},
+            "addresses": [{"address_purpose": "LOCATION", "state": state}]}
+
+
+@pytest.fixture
+def registry():
+    return FakeRegistry([record(1, "JOHN", "SMITH", "NY"), record(2, "JOHN", "SMITH", "NJ"),
+                         record(3, "ANN", "LEE", "NY")])
+
+
+@pytest.fixture
+def engine():
+    engine = AsyncRegistryEngine(max_concurrency=2, max_retries=0)
+    yield engine
+    engine.close()
+
+
+def test_record_then_replay(tmp_path, registry, engine):
+    path = str(tmp_path / "registry.cassette.json.gz")
+    recording = open_cassette("record", path)
+    with FakeRegistryServer(registry) as server:
+        engine.url = server.url
+        recorded = engine.query("John", "Smith", "", cassette=recording)
+        requests = server.requests
+    recording.save()
+    assert [r["number"] for r in recorded["results"]] == ["1", "2"]
+    assert recording.stats()["recorded"] == requests == 1
+
+    replaying = open_cassette("replay", path)
+    engine.url = UNREACHABLE_URL
+    # Names are matched case- and whitespace-insensitively
+    assert engine.query(" JOHN ", "smith", "", cassette=replaying) == recorded
+    assert replaying.stats() == {"mode": "replay", "pages": 1, "replayed": 1, "recorded": 0, "missing": 0}
+
+
+def test_replay_miss_is_an_error_not_a_network_call(tmp_path, registry, engine):
+    path = str(tmp_path / "registry.cassette.json.gz")
+    recording = RegistryCassette(path, mode="record")
+    recording.record(build_params("John", "Smith", ""), [record(1, "JOHN", "SMITH", "NY")])
+    recording.save()
+
+    replaying = RegistryCassette(path, mode="replay")
+    engine.url = UNREACHABLE_URL
+    response = engine.query("Ann", "Lee", "NY", cassette=replaying)
+    assert response["results"] == [] and "not in the registry cassette" in response["error"]
+    assert replaying.stats()["missing"] == 1
+
+
+def test_replay_needs_an_existing_cassette(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        RegistryCassette(str(tmp_path / "missing.json.gz"), mode="replay")
+
+
+def test_saves_keep_pages_saved_by_other_writers(tmp_path):
+    path = str(tmp_path / "registry.cassette.json.gz")
+    first, second = RegistryCassette(path, mode="record"), RegistryCassette(path, mode="record")
+    first.record(build_params("John", "Smith", ""), [record(1, "JOHN", "SMITH", "NY")])
+    second.record(build_params("Ann", "Lee", ""), [record(3, "ANN", "LEE", "NY")])
+    first.save()
+    second.save()
+    assert RegistryCassette(path).stats()["pages"] == 2
+    assert os.listdir(tmp_path) == ["registry.cassette.json.gz"]  # no temporary files left behind
@@ -0,0 +1,77 @@
+import pandas as pd
+
+from result_store import ResultStore
+
+
+def results():
+    # Three roster rows: two candidates for row 0, a No Match for row 1, one candidate for row 2.
+    # Rows 0 and 2 supply the same name and specialty, so only Row_ID tells them apart.
+    return pd.DataFrame({
+        "Row_ID": [0, 0, 1, 2],
+        "FIRST_LAST": ["John Smith", "John Smith", "Ann Lee", "John Smith"],
+        "First_Name_Supplied": ["John", "John", "Ann", "John"],
+        "Last_Name_Supplied": ["Smith", "Smith", "Lee", "Smith"],
+        "Specialty_Supplied": ["Cardiology", "Cardiology", "Surgery", "Cardiology"],
+        "Match_Level": ["Best", "Potential", "No Match", "Good"],
+        "NPI": ["1", "2", "", "3"],
+        "State_1": ["NY", "NJ", "", "NY"],
+        "State_2": ["NJ", "", "", "CT"],
+        "State_3": ["", "", "", ""],
+        "Specialty_1": ["Cardiology", "Internal Medicine", "", "Cardiology"],
+        "Specialty_2": ["", "Cardiology", "", ""],
+        "Matched Hospital": ["Mercy", "", "", "Mercy"],
+    })
+
+
+def test_options_skip_blank_values():
+    store = ResultStore(results())
+    assert store.options["state"] == ["CT", "NJ", "NY"]
+    assert store.options["specialty"] == ["Cardiology", "Internal Medicine"]
+    assert store.options["hospital"] == ["Mercy"]
+
+
+def test_rows_without_a_selection_are_all_rows():
+    store = ResultStore(results())
+    assert store.rows().tolist() == [0, 1, 2, 3]
+    assert store.rows(state=[], specialty=[]).tolist() == [0, 1, 2, 3]
+
+
+def test_rows_match_any_column_of_a_filter():
+    store = ResultStore(results())
+    assert store.rows(state=["NJ"]).tolist() == [0, 1]
+    assert store.rows(state=["CT", "NJ"]).tolist() == [0, 1, 3]
+    assert store.rows(specialty=["Cardiology"]).tolist() == [0, 1, 3]
+
+
+def test_rows_intersect_filters():
+    store = ResultStore(results())
+    assert store.rows(state=["NY"], match_level=["Good"]).tolist() == [3]
+    assert store.rows(state=["NJ"], hospital=["Mercy"]).tolist() == [0]
+    assert store.rows(state=["TX"]).tolist() == []
+
+
+def test_rows_agree_with_isin_filtering():
+    df = results()
+    store = ResultStore(df)
+    expected = df.index[
+        df[["State_1", "State_2", "State_3"]].isin(["NJ", "CT"]).any(axis=1)
+        & df[["Specialty_1", "Specialty_2"]].isin(["Cardiology"]).any(axis=1)
+    ]
+    assert store.rows(state=["NJ", "CT"], specialty=["Cardiology"]).tolist() == expected.tolist()
+    assert store.take(store.rows(state=["NJ", "CT"]))["NPI"].tolist() == ["1", "2", "3"]
+
+
+def test_summary_groups_providers_by_roster_row():
+    store = ResultStore(results())
+    summary = store.summary(store.rows())
+    assert summary["NPI"].tolist() == ["1", "", "3"]
+    assert summary["Candidates"].tolist() == [2, 0, 1]
+    assert store.summary(store.rows(), sort_by="Match_Level")["NPI"].tolist() == ["1", "3", ""]
+    assert store.candidates(summary.index[0], store.rows())["NPI"].tolist() == ["1", "2"]
+
+
+def test_summary_falls_back_to_supplied_names_without_row_ids():
+    store = ResultStore(results().drop(columns="Row_ID"))
+    summary = store.summary(store.rows())
+    assert summary["NPI"].tolist() == ["1", ""]
+    assert summary["Candidates"].tolist() == [3, 0]
@@ -0,0 +1,53 @@
+import pytest
+
+import run_journal
+from run_journal import RunJournal, make_run_id
+
+
+@pytest.fixture
+def journal(tmp_path, patch_clock):
+    patch_clock(run_journal, step=1.0)  # every timestamp is distinct
+    return RunJournal(str(tmp_path / "runs.sqlite3"), max_runs=2)
+
+
+def test_run_id_depends_on_upload_and_settings():
+    settings = {"strictness": "Lenient", "states": ["NY"]}
+    assert make_run_id(b"roster", settings) == make_run_id(b"roster", dict(reversed(settings.items())))
+    assert make_run_id(b"roster", settings) != make_run_id(b"roster2", settings)
+    assert make_run_id(b"roster", settings) != make_run_id(b"roster", {**settings, "states": []})
+
+
+def test_records_rows_until_finished(journal):
+    assert journal.status("run") is None
+    journal.start("run", 3, {"limit": 5})
+    journal.record("run", {0: [{"NPI": "1"}], 2: [{"NPI": "3"}, {"NPI": "4"}]})
+    assert journal.status("run") == {"done": 2, "total": 3, "finished": False}
+    assert journal.completed_rows("run") == {0: [{"NPI": "1"}], 2: [{"NPI": "3"}, {"NPI": "4"}]}
+    journal.record("run", {1: []})
+    journal.finish("run")
+    assert journal.status("run") == {"done": 3, "total": 3, "finished": True}
+
+
+def test_restart_keeps_journaled_rows(journal):
+    journal.start("run", 2, {})
+    journal.record("run", {0: [{"NPI": "1"}]})
+    journal.finish("run")
+    journal.start("run", 2, {})
+    assert journal.status("run") == {"done": 1, "total": 2, "finished": False}
+
+
+def test_start_drops_the_oldest_runs(journal):
+    for run_id in ("a", "b", "c"):
+        journal.start(run_id, 1, {})
+        journal.record(run_id, {0: []})
+    assert journal.status("a") is None
+    assert journal.completed_rows("a") == {}
+    assert journal.status("b")["done"] == journal.status("c")["done"] == 1
+
+
+def test_discard(journal):
+    journal.start("run", 1, {})
+    journal.record("run", {0: []})
+    journal.discard("run")
+    assert journal.status("run") is None
+    assert journal.completed_rows("run") == {}